@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Benchmark af værdiansættelse og sidevisning ved 10-10.000 positioner.
+
+Seeder en lokal mongod med syntetiske brugere og lange transaktionshistorikker, genererer
+syntetiske markedsdata-fixtures og kører appen mod replay-provideren (ingen netværk).
+"Varm" betyder varme markedsdata-caches: resultatcachen tømmes før hver måling, så tallene
+viser selve beregningen og ikke et opslag i cachen. Resultatet skrives som JSON, så to
+kørsler kan sammenlignes:
+
+    python benchmark.py --output bench.json
+    python benchmark.py --sizes 10,100 --compare bench.json   # exit 1 ved regression
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from pymongo import MongoClient
+
+from market_data import FixtureStore
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "portfolio_app_streamlit.py")
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+CURRENCIES = ["DKK", "USD", "EUR", "SEK"]
+FX_SYMBOLS = ["USDDKK=X", "EURDKK=X", "SEKDKK=X", "USDEUR=X", "USDSEK=X"]
+FIXTURE_PARAMS = {"interval": "1d", "auto_adjust": False}  # Samme nøgle som appens downloads
+
+# Kører inde i AppTest, så session_state og caches opfører sig som i en rigtig session.
+# Resultatcachen er fælles for processen og tømmes før hver måling
+FUNCTION_DRIVER = """
+import runpy, time
+import streamlit as st
+app = runpy.run_path({app_path!r}, run_name="benchmark")
+app["get_result_cache"]().clear()
+st.session_state.rerun_id = st.session_state.get("rerun_id", 0) + 1
+timings = {{}}
+for name in ("get_portfolio_value", "calculate_estimated_annual_dividend"):
+    started = time.perf_counter()
+    app[name]()
+    timings[name] = time.perf_counter() - started
+st.session_state["bench_timings"] = timings
+"""
+
+PAGE_DRIVER = """
+import runpy
+app = runpy.run_path({app_path!r}, run_name="benchmark")
+app["get_result_cache"]().clear()
+app["main"]()
+"""
+
+PAGES = {"show_dashboard": "Dashboard", "show_stocks": "Mine Aktier", "show_dividends": "Udbytter"}
+
+def synthetic_ticker(i):
+    return f"BENCH{i:05d}"
+
+def write_fixtures(store, count, days=750, seed=42):
+    """Kurshistorik, info og kvartalsvise udbytter for count tickers plus valutapar"""
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(end=pd.Timestamp.now().normalize(), periods=days)
+    for i in range(count):
+        ticker = synthetic_ticker(i)
+        close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, days)))
+        frame = pd.DataFrame({"Open": close, "High": close, "Low": close, "Close": close,
+                              "Adj Close": close, "Volume": 1000}, index=dates)
+        store.save("download", ticker, frame, FIXTURE_PARAMS)
+        store.save("info", ticker, {
+            "longName": f"Benchmark {i}",
+            "currency": CURRENCIES[i % len(CURRENCIES)],
+            "dividendRate": float(close[-1] * 0.03) if i % 3 else None,
+            "trailingAnnualDividendYield": 0.03,
+            "currentPrice": float(close[-1])
+        })
+        ex_dates = pd.date_range(dates[0], dates[-1], freq="QS") + pd.Timedelta(days=14)
+        store.save("dividends", ticker, pd.Series(close[-1] * 0.0075, index=ex_dates, dtype=float))
+    for symbol, level in zip(FX_SYMBOLS, [6.9, 7.46, 0.65, 0.92, 10.6]):
+        rate = level * np.exp(np.cumsum(rng.normal(0, 0.002, days)))
+        store.save("download", symbol, pd.DataFrame({"Close": rate, "Adj Close": rate}, index=dates), FIXTURE_PARAMS)
+
+def seed_user(db, username, positions, buys_per_position, seed=7):
+    """Bruger med positions aktier, hver købt over buys_per_position transaktioner"""
+    rng = np.random.default_rng(seed + positions)
+    for name in ("portfolio", "transactions", "cash", "portfolio_summary", "ledger_snapshots"):
+        db[name].delete_many({"username": username} if name != "portfolio_summary" else {"_id": username})
+
+    start = datetime.now() - timedelta(days=700)
+    deposit = 1_000_000.0 * positions
+    transactions = [{"username": username, "type": "deposit", "amount": deposit, "date": start}]
+    portfolio = []
+    spent = 0.0
+    for i in range(positions):
+        ticker = synthetic_ticker(i)
+        currency = CURRENCIES[i % len(CURRENCIES)]
+        shares_total, cost_total = 0, 0.0
+        for _ in range(buys_per_position):
+            shares = int(rng.integers(1, 20))
+            price = float(rng.uniform(50, 150))
+            shares_total += shares
+            cost_total += shares * price
+            spent += shares * price
+            transactions.append({
+                "username": username, "type": "buy", "ticker": ticker, "shares": shares,
+                "price": price, "currency": currency, "total": shares * price,
+                "date": start + timedelta(days=int(rng.integers(1, 690)))
+            })
+        portfolio.append({"username": username, "ticker": ticker, "shares": shares_total,
+                          "buy_price": cost_total / shares_total, "currency": currency})
+
+    transactions.sort(key=lambda t: t["date"])
+    for offset in range(0, len(transactions), 10_000):
+        db["transactions"].insert_many(transactions[offset:offset + 10_000], ordered=False)
+    db["portfolio"].insert_many(portfolio, ordered=False)
+    db["cash"].insert_one({"username": username, "amount": deposit - spent, "currency": "DKK"})
+    return len(transactions)
+
+def reset_market_caches(db):
+    """Kold start: tøm de delte caches i MongoDB og i processen"""
+    import streamlit as st
+    for name in ("quotes", "securities", "dividends"):
+        db[name].delete_many({})
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+def timed_run(at):
+    started = time.perf_counter()
+    at.run()
+    elapsed = time.perf_counter() - started
+    if at.exception:
+        raise RuntimeError(f"App fejlede: {at.exception}")
+    return elapsed
+
+def summarize(cold, warm):
+    return {
+        "cold": cold,
+        "warm_median": statistics.median(warm) if warm else None,
+        "warm_min": min(warm) if warm else None,
+        "warm": warm
+    }
+
+def bench_size(username, repeat, timeout):
+    """Kold og varm tid for funktioner og sider for én bruger"""
+    from streamlit.testing.v1 import AppTest
+
+    driver = AppTest.from_string(FUNCTION_DRIVER.format(app_path=APP_PATH), default_timeout=timeout)
+    driver.session_state["logged_in"] = True
+    driver.session_state["username"] = username
+    function_runs = []
+    for _ in range(repeat + 1):
+        timed_run(driver)
+        function_runs.append(driver.session_state["bench_timings"])
+
+    results = {
+        name: summarize(function_runs[0][name], [run[name] for run in function_runs[1:]])
+        for name in function_runs[0]
+    }
+
+    app = AppTest.from_string(PAGE_DRIVER.format(app_path=APP_PATH), default_timeout=timeout)
+    app.session_state["logged_in"] = True
+    app.session_state["username"] = username
+    timed_run(app)  # Første rerun renderer Dashboard og fylder caches
+    for function_name, page in PAGES.items():
+        app.sidebar.radio[0].set_value(page)
+        runs = [timed_run(app) for _ in range(repeat + 1)]
+        results[function_name] = summarize(runs[0], runs[1:])
+    return results
+
+def compare(report, baseline, threshold):
+    """Varm median mod baseline - returnerer regressioner over threshold"""
+    regressions = []
+    for size, results in report["results"].items():
+        for name, timing in results["timings"].items():
+            before = baseline.get("results", {}).get(size, {}).get("timings", {}).get(name, {}).get("warm_median")
+            after = timing["warm_median"]
+            if before and after:
+                ratio = after / before
+                marker = "!" if ratio > threshold else " "
+                print(f"  [{marker}] {size:>6} {name:<38} {before:8.3f}s -> {after:8.3f}s ({ratio:.2f}x)")
+                if ratio > threshold:
+                    regressions.append((size, name, ratio))
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(APP_PATH)).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark af værdiansættelse og sidevisning")
+    parser.add_argument("--uri", default=os.getenv("BENCHMARK_MONGODB_URI", "mongodb://localhost:27017"))
+    parser.add_argument("--database", default="stock_portfolio_benchmark")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    parser.add_argument("--buys-per-position", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3, help="varme gentagelser pr. måling")
+    parser.add_argument("--latency", type=float, default=0.05, help="replay-latenstid pr. upstream kald (s)")
+    parser.add_argument("--fixtures", help="fixture-mappe (default: midlertidig med syntetiske data)")
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--compare", help="tidligere rapport at sammenligne med")
+    parser.add_argument("--threshold", type=float, default=1.25, help="tilladt faktor før regression")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(",")]
+
+    fixtures = args.fixtures or tempfile.mkdtemp(prefix="bench_fixtures_")
+    if not args.fixtures:
+        print(f"[DEBUG] Genererer syntetiske fixtures for {max(sizes)} tickers i {fixtures}")
+        write_fixtures(FixtureStore(fixtures), max(sizes))
+
+    # Appen læser sin konfiguration fra miljøet ved import
+    os.environ.update({
+        "MONGODB_CONNECTION_STRING": args.uri,
+        "MONGODB_DATABASE": args.database,
+        "MARKET_DATA_PROVIDER": "replay",
+        "MARKET_DATA_FIXTURES": fixtures,
+        "MARKET_DATA_REPLAY_LATENCY": str(args.latency),
+        "MARKET_DATA_RATE": "1000000",
+        "MARKET_DATA_BURST": "1000000",
+        "CACHE_WARMER_ENABLED": "false",
+        "PRICE_STORE_DIR": tempfile.mkdtemp(prefix="bench_prices_")
+    })
+
+    db = MongoClient(args.uri, serverSelectionTimeoutMS=5000)[args.database]
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency": args.latency,
+            "repeat": args.repeat,
+            "buys_per_position": args.buys_per_position
+        },
+        "results": {}
+    }
+
+    for size in sizes:
+        username = f"bench_{size}"
+        seed_started = time.perf_counter()
+        transactions = seed_user(db, username, size, args.buys_per_position)
+        print(f"[DEBUG] {username}: {size} positioner, {transactions} transaktioner "
+              f"seedet på {time.perf_counter() - seed_started:.1f}s")
+        reset_market_caches(db)
+        timings = bench_size(username, args.repeat, args.timeout)
+        report["results"][str(size)] = {"positions": size, "transactions": transactions, "timings": timings}
+        for name, timing in timings.items():
+            print(f"  {name:<38} kold {timing['cold']:8.3f}s  varm {timing['warm_median']:8.3f}s")
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"[✓] Rapport skrevet til {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\n[DEBUG] Sammenligner med {args.compare} (tærskel {args.threshold:.2f}x)")
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"\n[!] {len(regressions)} regressioner")
+            sys.exit(1)
+        print("\n[✓] Ingen regressioner")
+
+if __name__ == "__main__":
+    main()
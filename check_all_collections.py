@@ -9,7 +9,7 @@ load_dotenv()
 CONNECTION_STRING = os.getenv("MONGODB_CONNECTION_STRING")
 
 client = MongoClient(CONNECTION_STRING, serverSelectionTimeoutMS=15000)
-db = client["stock_portfolio"]
+db = client[os.getenv("MONGODB_DATABASE", "stock_portfolio")]
 
 print("Collections in database:")
 for collection_name in db.list_collection_names():
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Index-styring for stock_portfolio databasen.
+
+Kør fra appen ved opstart (ensure_indexes) eller som CLI:
+    python db_indexes.py            # opret manglende indexes
+    python db_indexes.py --check    # opret + verificer at alle app-queries bruger et index
+"""
+
+import argparse
+import os
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.errors import OperationFailure
+
+QUOTE_STALE_RETENTION = 7 * 24 * 3600  # Default for TTL på quotes - appen sender sin indstilling med
+INDEX_OPTIONS_CONFLICT = 85  # Samme keys, andre options - fx ændret expireAfterSeconds
+
+# (collection, keys, options) - create_index er idempotent, så dette kan køres hver opstart
+INDEXES = [
+    ("portfolio", [("username", ASCENDING), ("ticker", ASCENDING)], {"unique": True, "name": "username_ticker"}),
+    # Cache-warmeren læser distinct ticker og valuta på tværs af alle brugere
+    ("portfolio", [("ticker", ASCENDING)], {"name": "ticker"}),
+    ("portfolio", [("currency", ASCENDING)], {"name": "currency"}),
+    ("transactions", [("username", ASCENDING), ("_id", ASCENDING)], {"name": "username_id"}),
+    ("ledger_snapshots", [("username", ASCENDING), ("last_event_id", DESCENDING)], {"name": "username_last_event_id"}),
+    ("users", [("username", ASCENDING)], {"unique": True, "name": "username"}),
+    ("cash", [("username", ASCENDING)], {"unique": True, "name": "username"}),
+    ("dividends", [("ticker", ASCENDING)], {"unique": True, "name": "ticker"}),
+]
+
+# Alle query-former appen udfører: (collection, filter, sort) - hold listen i takt med kaldene
+APP_QUERIES = [
+    # portfolio: køb/kompensation (app), replay og afstemning (ledger)
+    ("portfolio", {"username": "simon"}, None),
+    ("portfolio", {"username": "simon", "ticker": "AAPL"}, None),
+    ("portfolio", {"username": "simon", "ticker": "AAPL", "shares": {"$lte": 0}}, None),
+    ("portfolio", {"username": "simon", "ticker": {"$nin": ["AAPL"]}}, None),
+    # transactions: historik og replay efter snapshot, sletning ved kompensation
+    ("transactions", {"username": "simon"}, [("_id", ASCENDING)]),
+    ("transactions", {"username": "simon", "_id": {"$gt": ObjectId("000000000000000000000000")}}, [("_id", ASCENDING)]),
+    ("transactions", {"_id": ObjectId("000000000000000000000000")}, None),
+    ("ledger_snapshots", {"username": "simon"}, [("last_event_id", DESCENDING)]),
+    ("portfolio_summary", {"_id": "simon"}, None),
+    ("users", {"username": "simon"}, None),
+    ("cash", {"username": "simon"}, None),
+    ("cash", {"username": "simon", "amount": {"$gte": 100.0}}, None),
+    # dividends: batch-læsning, optimistisk opdatering på high-water mark og genlæsning
+    ("dividends", {"ticker": {"$in": ["AAPL", "NOVO-B.CO"]}}, None),
+    ("dividends", {"ticker": "AAPL", "last_ex_date": None}, None),
+    ("dividends", {"ticker": "AAPL"}, None),
+    ("securities", {"_id": {"$in": ["AAPL", "NOVO-B.CO"]}}, None),
+    ("quotes", {"_id": {"$in": ["AAPL", "USDDKK=X"]}}, None),
+    ("quotes", {"_id": {"$in": ["AAPL", "USDDKK=X"]}, "fetched_at": {"$gte": datetime(2024, 1, 1)}}, None),
+    ("locks", {"_id": "cache_warmer", "$or": [{"until": {"$lt": datetime(2024, 1, 1)}}, {"owner": "host:1"}]}, None),
+    ("schema_migrations", {"_id": "0006"}, None),
+]
+
+# distinct() uden filter: (collection, felt) - cache-warmeren og security master bulk-jobbet
+APP_DISTINCTS = [
+    ("portfolio", "ticker"),
+    ("portfolio", "currency"),
+]
+
+def ttl_indexes(quote_retention):
+    """TTL-indexes hvis levetid er en indstilling - sidst kendte kurser gemmes quote_retention sekunder"""
+    return [("quotes", [("fetched_at", ASCENDING)], {"expireAfterSeconds": int(quote_retention), "name": "fetched_at_1"})]
+
+def _create_index(db, collection_name, keys, options):
+    try:
+        db[collection_name].create_index(keys, **options)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT or "expireAfterSeconds" not in options:
+            raise
+        # TTL er ændret siden indexet blev oprettet - opdater det på stedet
+        db.command("collMod", collection_name,
+                   index={"keyPattern": dict(keys), "expireAfterSeconds": options["expireAfterSeconds"]})
+
+def ensure_indexes(db, quote_retention=None):
+    """Opret alle indexes - returnerer liste af (collection, index, fejl) for dem der fejlede"""
+    if quote_retention is None:
+        quote_retention = int(os.getenv("QUOTE_STALE_RETENTION", QUOTE_STALE_RETENTION))
+    errors = []
+    for collection_name, keys, options in INDEXES + ttl_indexes(quote_retention):
+        try:
+            _create_index(db, collection_name, keys, options)
+        except OperationFailure as e:
+            # Typisk dubletter der blokerer et unikt index - appen kører videre uden
+            print(f"[WARN] Kunne ikke oprette index {options['name']} på {collection_name}: {e}")
+            errors.append((collection_name, options["name"], str(e)))
+    return errors
+
+def _plan_stages(plan):
+    """Alle stage-navne i en (evt. indlejret) query plan"""
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_stages(item)
+
+def check_query_coverage(db):
+    """Kør explain() på alle app-queries - returnerer de queries der ender i COLLSCAN"""
+    uncovered = []
+    for collection_name, query, sort in APP_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = set(_plan_stages(winning_plan))
+        if "COLLSCAN" in stages:
+            uncovered.append((collection_name, query, sort))
+        print(f"  {collection_name:<13} {str(query):<55} {', '.join(sorted(stages))}")
+    for collection_name, key in APP_DISTINCTS:
+        explained = db.command("explain", {"distinct": collection_name, "key": key}, verbosity="queryPlanner")
+        stages = set(_plan_stages(explained["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages:
+            uncovered.append((collection_name, {"distinct": key}, None))
+        print(f"  {collection_name:<13} {'distinct ' + key:<55} {', '.join(sorted(stages))}")
+    return uncovered
+
+def main():
+    parser = argparse.ArgumentParser(description="Opret og verificer indexes i stock_portfolio")
+    parser.add_argument("--check", action="store_true", help="verificer med explain() at alle queries bruger et index")
+    parser.add_argument("--uri", help="MongoDB connection string (default: MONGODB_CONNECTION_STRING)")
+    args = parser.parse_args()
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    uri = args.uri or os.getenv("MONGODB_CONNECTION_STRING", "mongodb://localhost:27017")
+    client = MongoClient(uri, serverSelectionTimeoutMS=15000)
+    db = client[os.getenv("MONGODB_DATABASE", "stock_portfolio")]
+
+    print("[DEBUG] Opretter indexes...")
+    errors = ensure_indexes(db)
+    for collection_name, keys, options in INDEXES + ttl_indexes(0):
+        failed = any(e[0] == collection_name and e[1] == options["name"] for e in errors)
+        status = "FEJL" if failed else "OK"
+        print(f"  [{status}] {collection_name}.{options['name']}")
+
+    if args.check:
+        print("\n[DEBUG] Verificerer query plans...")
+        uncovered = check_query_coverage(db)
+        if uncovered:
+            print(f"\n[!] {len(uncovered)} queries bruger COLLSCAN")
+            raise SystemExit(1)
+        print("\n[✓] Alle queries bruger et index")
+
+    if errors:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
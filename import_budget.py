@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Import-tidsbudget for appen (koldstart i containeren).
+
+Importerer portfolio_app_streamlit i en frisk proces med `-X importtime`, rapporterer de
+tungeste imports og fejler hvis totalen overstiger budgettet, eller hvis moduler der skal
+indlæses dovent (markedsdata, grafer, Parquet) allerede er indlæst ved opstart:
+
+    python import_budget.py                   # rapport + tjek mod budget
+    python import_budget.py --budget-ms 1500 --json import_budget.json
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+APP_MODULE = "portfolio_app_streamlit"
+# Må først indlæses når en side der bruger dem, åbnes
+LAZY_MODULES = ("yfinance", "plotly", "pyarrow.parquet", "price_history")
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", 2000))
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+# Streamlit indlæser selv dele af plotly/pandas - kun det appen trækker ind ud over det tæller
+PROBE = (
+    "import json, sys; import streamlit; base = set(sys.modules); import {module}; "
+    "print(json.dumps(sorted(m for m in set(sys.modules) - base if m.startswith({lazy!r}))))"
+)
+
+def measure(module=APP_MODULE):
+    """Kør importen i en ny proces - returnerer (rækker, indlæste dovne moduler)"""
+    env = dict(os.environ)
+    # Appen pinger ikke ved import, så en ikke-eksisterende server koster intet
+    env.setdefault("MONGODB_CONNECTION_STRING", "mongodb://localhost:27017")
+    env.setdefault("CACHE_WARMER_ENABLED", "false")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(__file__)),
+                                                      env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, lazy=LAZY_MODULES)],
+        capture_output=True, text=True, env=env
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"[ERROR] Import fejlede:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append({"name": name, "self_ms": int(self_us) / 1000,
+                         "cumulative_ms": int(cumulative_us) / 1000, "depth": (len(indent) - 1) // 2})
+    loaded_lazy = json.loads(result.stdout.strip().splitlines()[-1])
+    return rows, loaded_lazy
+
+def summarize(rows, module=APP_MODULE, top=15):
+    """Streamlit (fast gulv), appens egen importtid og de tungeste imports appen selv trækker ind"""
+    streamlit_ms = next((r["cumulative_ms"] for r in rows if r["name"] == "streamlit" and r["depth"] == 0), 0.0)
+    app_ms = next((r["cumulative_ms"] for r in rows if r["name"] == module), None)
+    # importtime skriver børn før forælderen: appens imports er rækkerne siden forrige topniveau-række
+    children = []
+    for row in rows:
+        if row["depth"] == 0:
+            if row["name"] == module:
+                break
+            children = []
+        elif row["depth"] == 1:
+            children.append(row)
+    children.sort(key=lambda r: r["cumulative_ms"], reverse=True)
+    total = None if app_ms is None else streamlit_ms + app_ms
+    return {"total_ms": total, "streamlit_ms": streamlit_ms, "app_ms": app_ms, "top_level": children[:top]}
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-tidsbudget for appens koldstart")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--json", help="skriv rapporten som JSON hertil")
+    args = parser.parse_args()
+
+    rows, loaded_lazy = measure()
+    summary = summarize(rows)
+    print(f"[DEBUG] Koldstart: {summary['total_ms']:.0f} ms (budget {args.budget_ms:.0f} ms) - "
+          f"streamlit {summary['streamlit_ms']:.0f} ms, {APP_MODULE} {summary['app_ms']:.0f} ms")
+    for row in summary["top_level"]:
+        print(f"  {row['cumulative_ms']:8.1f} ms  {row['name']}")
+
+    report = {**summary, "budget_ms": args.budget_ms, "loaded_lazy_modules": loaded_lazy}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if loaded_lazy:
+        print(f"\n[!] Indlæst ved opstart, skal være dovne: {', '.join(loaded_lazy)}")
+        failed = True
+    if summary["total_ms"] is None or summary["total_ms"] > args.budget_ms:
+        print("\n[!] Over budget")
+        failed = True
+    if failed:
+        raise SystemExit(1)
+    print("\n[✓] Inden for budget")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Lette timing-spans for hot paths: markedsdata, MongoDB og sider.
+Kumulerede tal pr. proces (til Prometheus-dump) og spans pr. rerun (til Ydelse-panelet)
+"""
+
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+# Histogram-grænser i sekunder
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class SpanRegistry:
+    """Kumulerede span-tal pr. (kind, name) i processen plus en hook til spans pr. rerun"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+        self.rerun_sink = lambda: None  # Returnerer listen for den aktuelle rerun eller None
+
+    def record(self, kind, name, duration, error=False):
+        with self._lock:
+            series = self._series.setdefault((kind, name), {
+                "count": 0, "sum": 0.0, "max": 0.0, "errors": 0, "buckets": [0] * len(BUCKETS)
+            })
+            series["errors"] += int(error)
+            if duration is None:
+                return  # Kun en fejl der er håndteret lokalt - ingen varighed
+            series["count"] += 1
+            series["sum"] += duration
+            series["max"] = max(series["max"], duration)
+            for i, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    series["buckets"][i] += 1
+        try:
+            spans = self.rerun_sink()
+        except Exception:
+            spans = None  # Tråde uden Streamlit-kontekst (f.eks. cache-warmeren)
+        if spans is not None:
+            spans.append({"kind": kind, "name": name, "duration": duration, "error": error})
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {**value, "buckets": list(value["buckets"])} for key, value in self._series.items()}
+
+registry = SpanRegistry()
+
+@contextmanager
+def span(kind, name):
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        registry.record(kind, name, time.perf_counter() - started, error)
+
+def timed(kind, name=None):
+    """Decorator: hele kaldet som ét span"""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(kind, span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_error(kind, name, error):
+    """Tæl en fejl der bliver håndteret lokalt, så den ikke forsvinder i stilhed"""
+    print(f"[WARN] {kind}/{name}: {error}")
+    registry.record(kind, name, None, error=True)
+
+class MongoCommandTimer(monitoring.CommandListener):
+    """Alle MongoDB-kommandoer som spans: kind=mongo, name='<kommando> <collection>'"""
+
+    def __init__(self):
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        name = f"{event.command_name} {target}" if isinstance(target, str) else event.command_name
+        with self._lock:
+            self._names[(event.connection_id, event.request_id)] = name
+
+    def _finish(self, event, error):
+        with self._lock:
+            name = self._names.pop((event.connection_id, event.request_id), event.command_name)
+        registry.record("mongo", name, event.duration_micros / 1e6, error)
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+def _labels(kind, name):
+    escaped = name.replace("\\", "\\\\").replace('"', '\\"')
+    return f'kind="{kind}",name="{escaped}"'
+
+def prometheus_text(gauges=None):
+    """Kumulerede spans (histogram + fejl) og ekstra gauges i Prometheus text format"""
+    lines = [
+        "# HELP portfolio_span_seconds Varighed af instrumenterede kald",
+        "# TYPE portfolio_span_seconds histogram"
+    ]
+    series = registry.snapshot()
+    for (kind, name), value in sorted(series.items()):
+        labels = _labels(kind, name)
+        for bound, count in zip(BUCKETS, value["buckets"]):
+            lines.append(f'portfolio_span_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'portfolio_span_seconds_bucket{{{labels},le="+Inf"}} {value["count"]}')
+        lines.append(f"portfolio_span_seconds_sum{{{labels}}} {value['sum']:.6f}")
+        lines.append(f"portfolio_span_seconds_count{{{labels}}} {value['count']}")
+    lines += ["# HELP portfolio_span_errors_total Fejl i instrumenterede kald",
+              "# TYPE portfolio_span_errors_total counter"]
+    for (kind, name), value in sorted(series.items()):
+        lines.append(f"portfolio_span_errors_total{{{_labels(kind, name)}}} {value['errors']}")
+    for metric, value in sorted((gauges or {}).items()):
+        lines += [f"# TYPE {metric} gauge", f"{metric} {float(value)}"]
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path, gauges=None):
+    """Skriv metrics atomisk, så en scraper aldrig ser en halv fil"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(prometheus_text(gauges))
+    os.replace(tmp_path, path)
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Event-sourced ledger: `transactions` er sandheden, beholdninger og kontanter foldes fra events.
+
+Tilstanden genopbygges fra nyeste snapshot i `ledger_snapshots` + events efter dets
+last_event_id, så genopbygning koster O(nye events) i stedet for O(hele historikken).
+
+CLI:
+    python ledger.py audit [--user U]      # sammenlign ledger med portfolio/cash
+    python ledger.py reconcile [--user U]  # log adjustment-events så ledgeren matcher portfolio/cash
+    python ledger.py repair [--user U]     # skriv ledgerens tilstand til portfolio/cash
+    python ledger.py snapshot [--user U]   # tag snapshots nu
+"""
+
+import argparse
+import copy
+import os
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import DESCENDING, MongoClient, UpdateOne
+
+SNAPSHOT_EVERY = 100  # Nyt snapshot når så mange events er foldet siden det forrige
+SNAPSHOT_SETTLE_SECONDS = 60  # Events nyere end dette kan stadig være undervejs og snapshottes ikke
+COST_TOLERANCE = 0.01
+
+def empty_state():
+    return {"cash": 0.0, "positions": {}, "last_event_id": None, "event_count": 0}
+
+def _number(value, default=0.0):
+    try:
+        return float(value) if value not in (None, "") else default
+    except (TypeError, ValueError):
+        return default
+
+def apply_event(state, event):
+    """Fold ét transaktions-event ind i tilstanden"""
+    kind = event.get("type")
+    if kind == "deposit":
+        state["cash"] += _number(event.get("amount"))
+    elif kind == "withdrawal":
+        state["cash"] -= _number(event.get("amount"))
+    elif kind == "buy":
+        shares = int(_number(event.get("shares")))
+        price = _number(event.get("price"))
+        state["cash"] -= _number(event.get("total"))
+        position = state["positions"].setdefault(
+            event["ticker"], {"shares": 0, "cost": 0.0, "currency": event.get("currency") or "DKK"}
+        )
+        position["shares"] += shares
+        position["cost"] += price * shares
+    elif kind == "adjustment":
+        # Korrektion logget af reconcile - kan flytte både kontanter og en position
+        state["cash"] += _number(event.get("amount"))
+        if event.get("ticker"):
+            position = state["positions"].setdefault(
+                event["ticker"], {"shares": 0, "cost": 0.0, "currency": event.get("currency") or "DKK"}
+            )
+            position["shares"] += int(_number(event.get("shares")))
+            position["cost"] += _number(event.get("cost"))
+    state["last_event_id"] = event["_id"]
+    state["event_count"] += 1
+    return state
+
+def state_positions(state):
+    """Positioner med beholdning som liste (tickers kan indeholde punktum, så ikke som dict-felter)"""
+    return [
+        {"ticker": ticker, **position}
+        for ticker, position in sorted(state["positions"].items())
+        if position["shares"] != 0 or abs(position["cost"]) > COST_TOLERANCE
+    ]
+
+def _state_from_snapshot(snapshot):
+    return {
+        "cash": snapshot["cash"],
+        "positions": {p["ticker"]: {k: v for k, v in p.items() if k != "ticker"} for p in snapshot["positions"]},
+        "last_event_id": snapshot["last_event_id"],
+        "event_count": snapshot["event_count"]
+    }
+
+def save_snapshot(db, username, state):
+    db["ledger_snapshots"].insert_one({
+        "username": username,
+        "last_event_id": state["last_event_id"],
+        "event_count": state["event_count"],
+        "cash": state["cash"],
+        "positions": state_positions(state),
+        "created_at": datetime.now()
+    })
+
+def rebuild_user_state(db, username, snapshot_every=SNAPSHOT_EVERY):
+    """
+    Nyeste snapshot + events efter det. Tager et nyt snapshot når mindst snapshot_every
+    events, der er ældre end settle-vinduet, er foldet siden det forrige - aldrig hvis snapshot_every er None
+    """
+    snapshot = db["ledger_snapshots"].find_one({"username": username}, sort=[("last_event_id", DESCENDING)])
+    state = _state_from_snapshot(snapshot) if snapshot else empty_state()
+    snapshot_count = state["event_count"]
+
+    query = {"username": username}
+    if state["last_event_id"] is not None:
+        query["_id"] = {"$gt": state["last_event_id"]}
+
+    settle_cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - timedelta(seconds=SNAPSHOT_SETTLE_SECONDS))
+    settled = None
+    for event in db["transactions"].find(query).sort("_id", 1):
+        if settled is None and event["_id"] >= settle_cutoff:
+            settled = copy.deepcopy(state)
+        apply_event(state, event)
+    if settled is None:
+        settled = state
+
+    if snapshot_every is not None and settled["event_count"] - snapshot_count >= snapshot_every:
+        save_snapshot(db, username, settled)
+    return state
+
+def _current_documents(db, username):
+    """Beholdninger og kontanter som de ligger i portfolio/cash lige nu"""
+    positions = {}
+    for doc in db["portfolio"].find({"username": username}):
+        shares = int(_number(doc.get("shares")))
+        positions[doc["ticker"]] = {
+            "shares": shares,
+            "cost": _number(doc.get("buy_price")) * shares,
+            "currency": doc.get("currency") or "DKK"
+        }
+    cash_doc = db["cash"].find_one({"username": username})
+    return positions, _number(cash_doc.get("amount")) if cash_doc else 0.0
+
+def audit_user(db, username):
+    """Forskelle mellem ledgeren og portfolio/cash - tom liste betyder ingen drift. Skriver intet"""
+    state = rebuild_user_state(db, username, snapshot_every=None)
+    positions, cash = _current_documents(db, username)
+    differences = []
+    if abs(state["cash"] - cash) > COST_TOLERANCE:
+        differences.append({"ticker": None, "shares": 0, "cost": 0.0, "amount": cash - state["cash"]})
+    for ticker in sorted(set(positions) | set(state["positions"])):
+        actual = positions.get(ticker, {"shares": 0, "cost": 0.0, "currency": None})
+        replayed = state["positions"].get(ticker, {"shares": 0, "cost": 0.0, "currency": None})
+        if actual["shares"] != replayed["shares"] or abs(actual["cost"] - replayed["cost"]) > COST_TOLERANCE:
+            differences.append({
+                "ticker": ticker,
+                "shares": actual["shares"] - replayed["shares"],
+                "cost": actual["cost"] - replayed["cost"],
+                "amount": 0.0,
+                "currency": actual["currency"] or replayed["currency"]
+            })
+    return differences
+
+def adjustment_events(db, username):
+    """Adjustment-events der får ledgeren til at matche portfolio/cash - tom liste hvis ingen drift"""
+    return [
+        {"username": username, "type": "adjustment", "date": datetime.now(), **difference}
+        for difference in audit_user(db, username)
+    ]
+
+def reconcile_user(db, username):
+    """Log adjustment-events så ledgeren fremover matcher portfolio/cash"""
+    events = adjustment_events(db, username)
+    if events:
+        db["transactions"].insert_many(events)
+    return events
+
+def repair_user(db, username):
+    """Overskriv portfolio, cash og oversigten med ledgerens tilstand"""
+    state = rebuild_user_state(db, username)
+    positions = state_positions(state)
+    if positions:
+        db["portfolio"].bulk_write([
+            UpdateOne(
+                {"username": username, "ticker": p["ticker"]},
+                {"$set": {
+                    "shares": p["shares"],
+                    "buy_price": p["cost"] / p["shares"] if p["shares"] else 0.0,
+                    "currency": p["currency"]
+                }},
+                upsert=True
+            )
+            for p in positions
+        ], ordered=False)
+    db["portfolio"].delete_many({"username": username, "ticker": {"$nin": [p["ticker"] for p in positions]}})
+    db["cash"].update_one(
+        {"username": username},
+        {"$set": {"amount": state["cash"]}, "$setOnInsert": {"currency": "DKK"}},
+        upsert=True
+    )
+    # Oversigten genopbygges fra ledgeren ved næste læsning
+    db["portfolio_summary"].delete_one({"_id": username})
+    return state
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit, reconcile og repair af det event-sourcede ledger")
+    parser.add_argument("command", choices=["audit", "reconcile", "repair", "snapshot"])
+    parser.add_argument("--user", help="kun denne bruger (default: alle)")
+    args = parser.parse_args()
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    client = MongoClient(os.getenv("MONGODB_CONNECTION_STRING"), serverSelectionTimeoutMS=15000)
+    db = client[os.getenv("MONGODB_DATABASE", "stock_portfolio")]
+    usernames = [args.user] if args.user else db["transactions"].distinct("username")
+
+    for username in usernames:
+        if args.command == "audit":
+            differences = audit_user(db, username)
+            print(f"[{'!' if differences else '✓'}] {username}: {len(differences)} forskelle")
+            for difference in differences:
+                print(f"    {difference}")
+        elif args.command == "reconcile":
+            differences = reconcile_user(db, username)
+            print(f"[✓] {username}: {len(differences)} adjustment-events logget")
+        elif args.command == "repair":
+            state = repair_user(db, username)
+            print(f"[✓] {username}: {len(state_positions(state))} positioner, {state['cash']:,.2f} DKK")
+        elif args.command == "snapshot":
+            state = rebuild_user_state(db, username, snapshot_every=1)
+            print(f"[✓] {username}: snapshot efter {state['event_count']} events")
+
+if __name__ == "__main__":
+    main()
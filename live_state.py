@@ -0,0 +1,248 @@
+"""
+Live brugerstate via MongoDB change streams på portfolio, transactions og cash.
+
+Én lytter pr. proces holder de aktive brugeres oversigt (cash + positioner) i hukommelsen og
+lægger ændringer ind som deltaer, så sessioner ikke skal læse oversigten igen efter en handel
+i en anden fane eller på en anden enhed. Change streams kræver et replica set - på en
+standalone server slår lytteren sig selv fra, og appen læser oversigten som før.
+
+Oversigten seedes fra ledgeren, mens deltaer kommer fra portfolio- og cash-dokumenterne. De to
+kilder er kun ens efter migrering 0006 (afstemning), så indtil den er kørt, starter lytteren ikke.
+
+Lokalt single-node replica set til test:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval 'rs.initiate()'
+    MONGODB_CONNECTION_STRING="mongodb://localhost:27017/?replicaSet=rs0" streamlit run portfolio_app_streamlit.py
+"""
+
+import threading
+from collections import OrderedDict
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from ledger import _number
+
+WATCHED_COLLECTIONS = ("portfolio", "transactions", "cash")
+CHANGE_STREAM_UNSUPPORTED = 40573  # $changeStream på en standalone server
+CHANGE_STREAM_HISTORY_LOST = 286   # Resume-token er røget ud af oploggen
+RECONCILE_MIGRATION = "0006"       # Afstemning af ledgeren mod portfolio og cash
+
+class LiveStateCache:
+    """
+    Brugerstate i samme form som portfolio_summary: _id, cash, positions, generation, revision.
+    Hver delta bumper revision, og hver seed får en ny generation, så nøgler til cachede
+    resultater aldrig genbruges. Dokumenter læses med updateLookup og lægges ind som
+    absolutte værdier - en ændring der leveres to gange, giver samme resultat
+    """
+
+    def __init__(self, db, max_users=1000, max_await_ms=1000, retry_delay=5.0):
+        self.db = db
+        self.max_users = max_users
+        self.max_await_ms = max_await_ms
+        self.retry_delay = retry_delay
+        self._states = OrderedDict()  # username -> state
+        self._owners = {}  # (collection, _id) -> (username, ticker) - til sletninger
+        self._seq = 0  # Antal behandlede ændringer - et seed-token er værdien da oversigten blev læst
+        self._changed = {}  # username -> _seq ved brugerens seneste ændring
+        self._floor = 0  # _seq ved seneste ændring der kan have ramt alle brugere (reset, ukendt ejer)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.status = {"state": "starting", "events": 0, "applied": 0, "resets": 0, "error": None}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="live-state", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def live(self):
+        return self.status["state"] == "live"
+
+    # Sessioner
+    def get(self, username):
+        """Kopi af brugerens state, eller None hvis den ikke er kendt eller lytteren ikke er live"""
+        if not self.live:
+            return None
+        with self._lock:
+            state = self._states.get(username)
+            if state is None:
+                return None
+            self._states.move_to_end(username)
+            return {**state, "positions": [dict(p) for p in state["positions"]]}
+
+    def seed_token(self):
+        """Tages før oversigten læses - seed() afvises hvis brugeren er ændret ind imellem"""
+        with self._lock:
+            return self._seq
+
+    def seed(self, username, summary, token):
+        if not self.live:
+            return False
+        with self._lock:
+            # Kun ændringer for denne bruger (eller for alle) gør oversigten forældet
+            if max(self._floor, self._changed.get(username, 0)) > token:
+                return False
+            self._states[username] = {
+                "_id": username,
+                "cash": summary.get("cash", 0.0),
+                "positions": [dict(p) for p in summary.get("positions", [])],
+                "generation": f"live-{ObjectId()}",
+                "revision": 0
+            }
+            self._states.move_to_end(username)
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+            return True
+
+    def drop(self, username):
+        """Glem brugeren - næste læsning går til oversigten i MongoDB (bruges efter egne skrivninger)"""
+        with self._lock:
+            self._states.pop(username, None)
+
+    # Lytter
+    def _pipeline(self):
+        return [{"$match": {
+            "ns.coll": {"$in": list(WATCHED_COLLECTIONS)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]}
+        }}]
+
+    def _reset(self, reason):
+        """Ændringer kan være tabt - al state smides væk og seedes forfra"""
+        with self._lock:
+            self._states.clear()
+            self._owners.clear()
+            self._seq += 1
+            self._floor = self._seq
+        self.status["resets"] += 1
+        self.status["error"] = str(reason)
+
+    def _ledger_reconciled(self):
+        record = self.db["schema_migrations"].find_one({"_id": RECONCILE_MIGRATION}, {"status": 1})
+        return (record or {}).get("status") == "applied"
+
+    def _run(self):
+        try:
+            self._listen()
+        finally:
+            # Hvad end der stopper tråden, må sessioner ikke læse en state der ikke længere følges
+            if self.status["state"] not in ("unsupported", "unreconciled"):
+                self.status["state"] = "stopped"
+
+    def _listen(self):
+        resume_token = None
+        reconciled = False
+        while not self._stop.is_set():
+            try:
+                if not reconciled:
+                    if not self._ledger_reconciled():
+                        self.status["state"] = "unreconciled"
+                        print(f"[DEBUG] Migrering {RECONCILE_MIGRATION} er ikke kørt - live opdateringer er slået fra")
+                        return
+                    reconciled = True
+                with self.db.watch(self._pipeline(), full_document="updateLookup", resume_after=resume_token,
+                                   max_await_time_ms=self.max_await_ms) as stream:
+                    self.status["state"] = "live"
+                    while stream.alive and not self._stop.is_set():
+                        change = stream.try_next()
+                        if change is not None:
+                            try:
+                                self.apply(change)
+                            except Exception as e:
+                                # Én skæv ændring må ikke stoppe lytteren - state kan være halvt opdateret
+                                print(f"[WARN] Kunne ikke anvende ændring {change.get('documentKey')}: {e}")
+                                self._reset(e)
+                        resume_token = stream.resume_token
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED:
+                    self.status["state"] = "unsupported"
+                    print("[DEBUG] Change streams kræver replica set - live opdateringer er slået fra")
+                    return
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    resume_token = None
+                self._fail(e, resume_token)
+            except PyMongoError as e:
+                self._fail(e, resume_token)
+            except Exception as e:
+                self._fail(e, None)
+            if not self._stop.is_set():
+                self._stop.wait(self.retry_delay)
+
+    def _fail(self, error, resume_token):
+        print(f"[WARN] Change stream afbrudt: {error}")
+        self.status["state"] = "reconnecting"
+        if resume_token is None:
+            self._reset(error)
+        else:
+            self.status["error"] = str(error)
+
+    def apply(self, change):
+        """Læg én ændring ind i den berørte brugers state"""
+        collection = change["ns"]["coll"]
+        operation = change["operationType"]
+        doc = change.get("fullDocument")
+        key = (collection, change["documentKey"]["_id"])
+
+        with self._lock:
+            self._seq += 1
+            self.status["events"] += 1
+            if operation == "delete" or doc is None:
+                owner = self._owners.pop(key, None)
+                if owner is None:
+                    # Ukendt ejer: vi ved ikke hvem der er berørt
+                    self._states.clear()
+                    self._floor = self._seq
+                    return
+                username, ticker = owner
+                self._changed[username] = self._seq
+                state = self._states.get(username)
+                if state is not None and collection == "portfolio":
+                    state["positions"] = [p for p in state["positions"] if p["ticker"] != ticker]
+                    state["revision"] += 1
+                elif state is not None:
+                    del self._states[username]  # Konto eller ledger slettet - læs forfra
+                return
+
+            username = doc.get("username")
+            self._changed[username] = self._seq
+            if collection != "transactions":
+                self._owners[key] = (username, doc.get("ticker"))
+            state = self._states.get(username)
+            if state is None:
+                return
+            if collection == "cash":
+                state["cash"] = _number(doc.get("amount"))
+            elif collection == "portfolio":
+                self._apply_position(state, doc)
+            elif operation == "insert":
+                state["last_event_id"] = doc["_id"]
+            else:
+                del self._states[username]  # Ledgeren er rettet bagud - læs forfra
+                return
+            state["revision"] += 1
+            self.status["applied"] += 1
+
+    @staticmethod
+    def _apply_position(state, doc):
+        # Samme tolkning som ledgeren - ældre dokumenter kan have tal gemt som tekst
+        shares = int(_number(doc.get("shares")))
+        position = {
+            "ticker": doc["ticker"],
+            "shares": shares,
+            "cost": _number(doc.get("buy_price")) * shares,
+            "currency": doc.get("currency")
+        }
+        positions = [p for p in state["positions"] if p["ticker"] != doc["ticker"]]
+        if shares:
+            positions.append(position)
+        state["positions"] = sorted(positions, key=lambda p: p["ticker"])
+
+    def get_status(self):
+        with self._lock:
+            users = len(self._states)
+        return {**self.status, "users": users}
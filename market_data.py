@@ -0,0 +1,219 @@
+"""
+Markedsdata-providere: yfinance, optagelse til lokale komprimerede fixtures og afspilning
+af dem med injiceret latenstid - så appen kan profileres og loadtestes offline.
+
+Alle providere har samme interface:
+    download(tickers, **kwargs) -> DataFrame som yf.download
+    info(ticker)                -> dict som yf.Ticker(t).info
+    dividends(ticker, start)    -> Series (ex-dato -> beløb), alle hvis start er None
+"""
+
+import gzip
+import hashlib
+import os
+import pickle
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import pandas as pd
+
+from resilience import ThrottledError, is_throttle
+
+# Parametre der ikke ændrer data og derfor ikke indgår i fixture-nøglen
+PRESENTATION_KWARGS = {"group_by", "progress", "threads", "start", "end", "period"}
+
+class MarketDataProvider(ABC):
+    """Basisklasse - en provider der mangler en metode, fejler allerede ved oprettelse"""
+
+    name = "base"
+
+    @abstractmethod
+    def download(self, tickers, **kwargs):
+        """DataFrame som yf.download"""
+
+    @abstractmethod
+    def info(self, ticker):
+        """Dict som yf.Ticker(t).info"""
+
+    @abstractmethod
+    def dividends(self, ticker, start=None):
+        """Series (ex-dato -> beløb), alle hvis start er None"""
+
+class YFinanceProvider(MarketDataProvider):
+    name = "yfinance"
+
+    def download(self, tickers, **kwargs):
+        import yfinance as yf
+        data = yf.download(list(tickers), **kwargs)
+        # yf.download sluger fejl pr. ticker - throttling skal op som exception, så vagten ser den
+        errors = list(yf.shared._ERRORS.values())
+        if any(is_throttle(error) for error in errors):
+            raise ThrottledError(errors[0])
+        return data
+
+    def info(self, ticker):
+        import yfinance as yf
+        return yf.Ticker(ticker).info
+
+    def dividends(self, ticker, start=None):
+        import yfinance as yf
+        if start is None:
+            return yf.Ticker(ticker).dividends
+        history = yf.Ticker(ticker).history(start=pd.Timestamp(start).strftime('%Y-%m-%d'), actions=True)
+        if 'Dividends' not in history.columns:
+            return pd.Series(dtype=float)
+        return history['Dividends'][history['Dividends'] > 0]
+
+def split_download(data, tickers):
+    """yf.download-resultat -> {ticker: flad frame med Open/High/Low/Close/...}"""
+    if data is None or data.empty:
+        return {}
+    if not isinstance(data.columns, pd.MultiIndex):
+        return {tickers[0]: data} if len(tickers) == 1 else {}
+    frames = {}
+    for ticker in data.columns.get_level_values(1).unique():
+        frame = data.xs(ticker, axis=1, level=1).dropna(how="all")
+        if not frame.empty:
+            frames[ticker] = frame
+    return frames
+
+def join_download(frames, tickers):
+    """Omvendt af split_download - samme kolonneform som yf.download(group_by="column")"""
+    present = [t for t in tickers if t in frames]
+    if not present:
+        return pd.DataFrame()
+    if len(tickers) == 1:
+        return frames[present[0]]
+    joined = pd.concat({t: frames[t] for t in present}, axis=1)
+    return joined.swaplevel(0, 1, axis=1).sort_index(axis=1, level=0, sort_remaining=False)
+
+class FixtureStore:
+    """Gzip-komprimerede pickles pr. (type, symbol, parametre) i en mappe"""
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def path(self, kind, symbol, params=None):
+        safe = re.sub(r"[^A-Za-z0-9._-]", "_", symbol)
+        digest = hashlib.sha1(repr(sorted((params or {}).items())).encode()).hexdigest()[:10]
+        return os.path.join(self.root, kind, f"{safe}-{digest}.pkl.gz")
+
+    def load(self, kind, symbol, params=None):
+        path = self.path(kind, symbol, params)
+        if not os.path.exists(path):
+            raise LookupError(f"Ingen fixture for {kind} {symbol} {params or ''}")
+        with gzip.open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, kind, symbol, value, params=None):
+        path = self.path(kind, symbol, params)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            tmp_path = f"{path}.tmp"
+            with gzip.open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+
+    def merge_series(self, kind, symbol, value, params=None):
+        """Gem tidsserie/frame sammen med det der allerede er optaget (nyeste vinder)"""
+        try:
+            existing = self.load(kind, symbol, params)
+        except LookupError:
+            existing = None
+        if existing is not None and len(existing) > 0:
+            value = pd.concat([existing, value])
+            value = value[~value.index.duplicated(keep="last")].sort_index()
+        self.save(kind, symbol, value, params)
+
+def _data_params(kwargs):
+    return {k: v for k, v in kwargs.items() if k not in PRESENTATION_KWARGS}
+
+class RecordingProvider(MarketDataProvider):
+    """Kalder en rigtig provider og gemmer svarene pr. symbol i fixture-lageret"""
+
+    name = "record"
+
+    def __init__(self, inner, store):
+        self.inner = inner
+        self.store = store
+
+    def download(self, tickers, **kwargs):
+        tickers = list(tickers)
+        data = self.inner.download(tickers, **kwargs)
+        for ticker, frame in split_download(data, tickers).items():
+            self.store.merge_series("download", ticker, frame, _data_params(kwargs))
+        return data
+
+    def info(self, ticker):
+        info = self.inner.info(ticker)
+        self.store.save("info", ticker, info)
+        return info
+
+    def dividends(self, ticker, start=None):
+        dividends = self.inner.dividends(ticker, start)
+        self.store.merge_series("dividends", ticker, dividends)
+        return dividends
+
+class ReplayProvider(MarketDataProvider):
+    """
+    Server optagede svar med latency + op til jitter sekunders forsinkelse pr. kald.
+    Manglende fixtures giver LookupError - samme som et ukendt symbol upstream
+    """
+
+    name = "replay"
+
+    def __init__(self, store, latency=0.0, jitter=0.0, sleep=time.sleep):
+        self.store = store
+        self.latency = latency
+        self.jitter = jitter
+        self.sleep = sleep
+
+    def _delay(self):
+        delay = self.latency + random.random() * self.jitter
+        if delay > 0:
+            self.sleep(delay)
+
+    def download(self, tickers, **kwargs):
+        self._delay()
+        tickers = list(tickers)
+        frames = {}
+        for ticker in tickers:
+            try:
+                frame = self.store.load("download", ticker, _data_params(kwargs))
+            except LookupError:
+                continue
+            if kwargs.get("start") is not None:
+                frame = frame[frame.index >= pd.Timestamp(kwargs["start"])]
+            period = re.fullmatch(r"(\d+)d", str(kwargs.get("period") or ""))
+            if period:
+                frame = frame.tail(int(period.group(1)))
+            if not frame.empty:
+                frames[ticker] = frame
+        return join_download(frames, tickers)
+
+    def info(self, ticker):
+        self._delay()
+        return self.store.load("info", ticker)
+
+    def dividends(self, ticker, start=None):
+        self._delay()
+        dividends = self.store.load("dividends", ticker)
+        if start is not None:
+            index = dividends.index.tz_localize(None) if getattr(dividends.index, "tz", None) else dividends.index
+            dividends = dividends[index >= pd.Timestamp(start)]
+        return dividends
+
+def create_provider(mode="yfinance", fixtures_dir="fixtures/market_data", latency=0.0, jitter=0.0):
+    """Provider ud fra konfiguration: yfinance, record eller replay"""
+    if mode == "yfinance":
+        return YFinanceProvider()
+    store = FixtureStore(fixtures_dir)
+    if mode == "record":
+        return RecordingProvider(YFinanceProvider(), store)
+    if mode == "replay":
+        return ReplayProvider(store, latency=latency, jitter=jitter)
+    raise ValueError(f"Ukendt markedsdata-provider: {mode}")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Versionerede datamigreringer med checkpoint og genoptagelse.
+
+Hvert trin streamer de dokumenter der skal migreres, sorteret på _id, i batches og skriver
+med bulk_write (unordered, medmindre trinnet kræver rækkefølge). Efter hver batch gemmes sidste _id i `schema_migrations`,
+så en afbrudt kørsel fortsætter hvor den slap. Alle trin er idempotente, så en batch der
+blev skrevet men ikke checkpointet, kan køres igen uden at tælle dobbelt.
+
+    python migrations.py status
+    python migrations.py run --dry-run                 # vis hvad der ville ske, skriv intet
+    python migrations.py run --batch-size 500 --default-user simon
+    python migrations.py run --to 0003 --pause-ms 50   # skån en travl server
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime
+
+from pymongo import DeleteOne, InsertOne, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from db_indexes import ensure_indexes
+from ledger import adjustment_events
+
+DEFAULT_BATCH_SIZE = 1000
+SAMPLE_OPS = 3  # Eksempler der vises pr. trin i dry-run
+
+class Migration:
+    """
+    Ét versioneret trin: query udvælger dokumenter i collection, build_ops(db, doc, options)
+    returnerer de skriveoperationer dokumentet skal give mod target (default samme collection).
+    ordered=True når et dokuments operationer afhænger af hinanden, fx kreditér før slet
+    """
+
+    def __init__(self, version, description, collection, query, build_ops, projection=None,
+                 needs_user=False, target=None, ordered=False):
+        self.version = version
+        self.description = description
+        self.collection = collection
+        self.target = target or collection
+        self.query = query
+        self.build_ops = build_ops
+        self.projection = projection
+        self.needs_user = needs_user
+        self.ordered = ordered
+
+def _set_username(db, doc, options):
+    return [UpdateOne({"_id": doc["_id"], "username": {"$exists": False}},
+                      {"$set": {"username": options["default_user"]}})]
+
+def _move_global_cash(db, doc, options):
+    """
+    Læg et globalt kontantdokument over på standardbrugerens konto og slet det.
+    migrated_from husker flyttede dokumenter, så beløbet aldrig lægges til to gange.
+    Køres ordered: fejler krediteringen, stopper batchen før sletningen, og saldoen går ikke tabt
+    """
+    source = doc["_id"]
+    already = {"$in": [source, {"$ifNull": ["$migrated_from", []]}]}
+    return [
+        UpdateOne({"username": options["default_user"]}, [{"$set": {
+            "amount": {"$cond": [already, "$amount",
+                                 {"$add": [{"$ifNull": ["$amount", 0.0]}, doc.get("amount", 0.0)]}]},
+            "currency": {"$ifNull": ["$currency", doc.get("currency", "DKK")]},
+            "migrated_from": {"$setUnion": [{"$ifNull": ["$migrated_from", []]}, [source]]}
+        }}], upsert=True),
+        DeleteOne({"_id": source})
+    ]
+
+def _ensure_cash_account(db, doc, options):
+    return [UpdateOne({"username": doc["username"]},
+                      {"$setOnInsert": {"amount": 0.0, "currency": "DKK"}}, upsert=True)]
+
+def _normalize_dividends(db, doc, options):
+    # info er flyttet til securities - last_ex_date er high-water mark for inkrementel opdatering
+    return [UpdateOne({"_id": doc["_id"]}, [
+        {"$set": {"last_ex_date": {"$ifNull": ["$last_ex_date", {"$max": "$payouts.ex_date"}]}}},
+        {"$unset": "info"}
+    ])]
+
+def _reconcile_ledger(db, doc, options):
+    # Efter flytningen af den globale saldo skal ledgeren følge dokumenterne, ellers viser
+    # oversigten (ledger) og Kontanter/køb (cash) hver sin saldo for altid
+    return [InsertOne(event) for event in adjustment_events(db, doc["username"])]
+
+def _drop_summary(db, doc, options):
+    return [DeleteOne({"_id": doc["_id"]})]
+
+MIGRATIONS = [
+    Migration("0001", "username på portfolio", "portfolio",
+              {"username": {"$exists": False}}, _set_username, {"_id": 1}, needs_user=True),
+    Migration("0002", "username på transactions", "transactions",
+              {"username": {"$exists": False}}, _set_username, {"_id": 1}, needs_user=True),
+    Migration("0003", "global kontantsaldo til brugerkonto", "cash",
+              {"username": {"$exists": False}}, _move_global_cash, {"amount": 1, "currency": 1}, needs_user=True,
+              ordered=True),
+    Migration("0004", "kontantkonto for alle brugere", "users",
+              {}, _ensure_cash_account, {"username": 1}, target="cash"),
+    Migration("0005", "udbyttedokumenter uden info og med last_ex_date", "dividends",
+              {"$or": [{"info": {"$exists": True}}, {"last_ex_date": {"$exists": False}}]},
+              _normalize_dividends, {"_id": 1}),
+    Migration("0006", "afstem ledgeren med portfolio og cash", "users",
+              {}, _reconcile_ledger, {"username": 1}, target="transactions"),
+    Migration("0007", "genopbyg portfolio_summary fra den afstemte ledger", "portfolio_summary",
+              {}, _drop_summary, {"_id": 1}),
+]
+
+class MigrationRunner:
+    """Kører trin i versionsrækkefølge og registrerer fremdrift i `schema_migrations`"""
+
+    def __init__(self, db, migrations=MIGRATIONS, batch_size=DEFAULT_BATCH_SIZE, dry_run=False,
+                 pause=0.0, options=None):
+        self.db = db
+        self.migrations = sorted(migrations, key=lambda m: m.version)
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.pause = pause
+        self.options = options or {}
+        self.records = db["schema_migrations"]
+
+    def status(self):
+        records = {r["_id"]: r for r in self.records.find()}
+        return [(m, records.get(m.version)) for m in self.migrations]
+
+    def pending(self, target=None):
+        return [m for m, record in self.status()
+                if (record or {}).get("status") != "applied" and (target is None or m.version <= target)]
+
+    def _checkpoint(self, migration, fields):
+        if not self.dry_run:
+            self.records.update_one(
+                {"_id": migration.version},
+                {"$set": {**fields, "description": migration.description, "updated_at": datetime.now()}},
+                upsert=True
+            )
+
+    def _batches(self, migration, after_id):
+        query = dict(migration.query)
+        if after_id is not None:
+            query = {"$and": [query, {"_id": {"$gt": after_id}}]}
+        # Cursoren holder kun én batch i hukommelsen ad gangen
+        cursor = self.db[migration.collection].find(query, migration.projection).sort("_id", 1)
+        batch = []
+        for doc in cursor.batch_size(self.batch_size):
+            batch.append(doc)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def run_one(self, migration):
+        """Kør ét trin fra sidste checkpoint - returnerer trinnets tal"""
+        if migration.needs_user and not self.options.get("default_user"):
+            raise SystemExit(f"[ERROR] {migration.version} kræver --default-user")
+
+        record = self.records.find_one({"_id": migration.version}) or {}
+        after_id = record.get("last_id")
+        stats = {"scanned": record.get("scanned", 0), "operations": record.get("operations", 0),
+                 "modified": record.get("modified", 0), "upserted": record.get("upserted", 0),
+                 "deleted": record.get("deleted", 0)}
+        if after_id is not None:
+            print(f"[DEBUG] {migration.version}: fortsætter efter _id {after_id} ({stats['scanned']} allerede scannet)")
+        self._checkpoint(migration, {"status": "running", "started_at": record.get("started_at") or datetime.now()})
+
+        started = time.perf_counter()
+        scanned_now = 0
+        samples = []
+        for batch in self._batches(migration, after_id):
+            ops = [op for doc in batch for op in migration.build_ops(self.db, doc, self.options)]
+            if self.dry_run:
+                samples.extend(ops[:SAMPLE_OPS - len(samples)])
+            elif ops:
+                try:
+                    result = self.db[migration.target].bulk_write(ops, ordered=migration.ordered)
+                except BulkWriteError as e:
+                    # Checkpointet flyttes ikke forbi batchen - den køres igen næste gang
+                    errors = [error.get("errmsg") for error in e.details.get("writeErrors", [])[:5]]
+                    self._checkpoint(migration, {"status": "failed", "errors": errors})
+                    raise SystemExit(f"[ERROR] {migration.version} fejlede efter _id {after_id}: {errors}")
+                stats["modified"] += result.modified_count
+                stats["upserted"] += result.upserted_count
+                stats["deleted"] += result.deleted_count
+
+            after_id = batch[-1]["_id"]
+            scanned_now += len(batch)
+            stats["scanned"] += len(batch)
+            stats["operations"] += len(ops)
+            elapsed = time.perf_counter() - started
+            print(f"  {migration.version}: {stats['scanned']} dokumenter, {stats['operations']} operationer "
+                  f"({scanned_now / elapsed if elapsed else 0:,.0f} dok/s)")
+            self._checkpoint(migration, {"last_id": after_id, **stats})
+            if self.pause:
+                time.sleep(self.pause)
+
+        elapsed = time.perf_counter() - started
+        stats["seconds"] = round(elapsed, 3)
+        stats["docs_per_second"] = round(scanned_now / elapsed, 1) if elapsed and scanned_now else 0.0
+        if self.dry_run:
+            for op in samples:
+                print(f"    {op}")
+        else:
+            self._checkpoint(migration, {**stats, "status": "applied", "applied_at": datetime.now(), "errors": []})
+        return stats
+
+    def run(self, target=None):
+        pending = self.pending(target)
+        if not pending:
+            print("[✓] Ingen ventende migreringer")
+            return []
+        results = []
+        for migration in pending:
+            print(f"\n=== {migration.version} {migration.description}{' (dry-run)' if self.dry_run else ''} ===")
+            stats = self.run_one(migration)
+            print(f"[✓] {migration.version}: {stats['scanned']} scannet, {stats['operations']} operationer, "
+                  f"{stats['modified']} ændret, {stats['upserted']} oprettet, {stats['deleted']} slettet "
+                  f"på {stats['seconds']:.1f}s ({stats['docs_per_second']:,.0f} dok/s)")
+            results.append((migration, stats))
+        if not self.dry_run:
+            ensure_indexes(self.db)  # Unikke indexes kan først oprettes når data er migreret
+        return results
+
+def main():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    parser = argparse.ArgumentParser(description="Versionerede, genoptagelige datamigreringer")
+    parser.add_argument("command", choices=["status", "run"])
+    parser.add_argument("--to", help="kør kun til og med denne version")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="vis hvad der ville ske uden at skrive")
+    parser.add_argument("--pause-ms", type=float, default=0.0, help="pause mellem batches")
+    parser.add_argument("--default-user", default=os.getenv("MIGRATION_DEFAULT_USER"),
+                        help="ejer af dokumenter uden username")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv("MONGODB_CONNECTION_STRING"), serverSelectionTimeoutMS=15000)
+    db = client[os.getenv("MONGODB_DATABASE", "stock_portfolio")]
+    runner = MigrationRunner(db, batch_size=args.batch_size, dry_run=args.dry_run,
+                             pause=args.pause_ms / 1000, options={"default_user": args.default_user})
+
+    if args.command == "status":
+        for migration, record in runner.status():
+            record = record or {}
+            state = record.get("status", "pending")
+            progress = f", {record['scanned']} scannet" if record.get("scanned") else ""
+            print(f"[{'✓' if state == 'applied' else ' '}] {migration.version} {migration.description}: {state}{progress}")
+    else:
+        runner.run(args.to)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,30 @@
 import streamlit as st
 import pandas as pd
+from collections import OrderedDict
 from datetime import datetime, timedelta
-import yfinance as yf
-from pymongo import MongoClient
-import plotly.graph_objects as go
-import plotly.express as px
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import numpy as np
 import logging
+import math
 import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from valuation import build_holdings_frame, value_holdings, summarize_valuation
+from db_indexes import ensure_indexes
+from ledger import rebuild_user_state, state_positions
+from singleflight import SingleFlight
+from resilience import CircuitBreaker, TokenBucket, Upstream
+from market_data import create_provider
+from securities import SecurityMaster, security_from_info
+from live_state import LiveStateCache
+from instrumentation import MongoCommandTimer, record_error, registry, timed, write_prometheus
+from dividends import (build_dividend_frames, estimate_annual_dividends,
+                       project_upcoming_dividends, monthly_dividend_cashflow)
 
 # Try to load .env file for local development
 try:
@@ -23,14 +40,6 @@ logging.getLogger("urllib3").setLevel(logging.CRITICAL)
 # Page configuration
 st.set_page_config(page_title="Aktieportfolio Manager", layout="wide", initial_sidebar_state="expanded")
 
-# Initialize session state for caching
-if "stock_cache" not in st.session_state:
-    st.session_state.stock_cache = {}
-    st.session_state.stock_cache_time = {}
-if "dividend_cache" not in st.session_state:
-    st.session_state.dividend_cache = {}
-    st.session_state.dividend_cache_time = {}
-
 # Custom CSS
 st.markdown("""
     <style>
@@ -53,26 +62,45 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# MongoDB Connection
-try:
-    CONNECTION_STRING = st.secrets["MONGODB_CONNECTION_STRING"]
-except (KeyError, FileNotFoundError):
-    # Fallback to .env file for local development
-    CONNECTION_STRING = os.getenv("MONGODB_CONNECTION_STRING")
-    if not CONNECTION_STRING:
-        print("[ERROR] MONGODB_CONNECTION_STRING not found in secrets or .env file")
-        raise ValueError("MONGODB_CONNECTION_STRING not configured")
+# Uden secrets.toml viser hvert opslag i st.secrets en fejlboks - så kig kun efter én gang
+HAS_SECRETS = st.secrets.load_if_toml_exists()
+
+def get_setting(name, default=None):
+    """Læs en indstilling fra st.secrets med fallback til miljøvariabler"""
+    if HAS_SECRETS and name in st.secrets:
+        return st.secrets[name]
+    return os.getenv(name, default)
+
+# MongoDB Connection - secrets på Streamlit Cloud, .env ved lokal udvikling
+CONNECTION_STRING = get_setting("MONGODB_CONNECTION_STRING")
+if not CONNECTION_STRING:
+    print("[ERROR] MONGODB_CONNECTION_STRING not found in secrets or .env file")
+    raise ValueError("MONGODB_CONNECTION_STRING not configured")
+DATABASE_NAME = get_setting("MONGODB_DATABASE", "stock_portfolio")
 
 @st.cache_resource
 def init_mongodb():
+    # Ingen ping: MongoClient forbinder i baggrunden, så login-siden ikke venter på netværket
     try:
-        client = MongoClient(CONNECTION_STRING, serverSelectionTimeoutMS=5000, connectTimeoutMS=5000)
-        client.admin.command('ping')
-        return client
+        return MongoClient(CONNECTION_STRING, serverSelectionTimeoutMS=5000, connectTimeoutMS=5000,
+                           event_listeners=[MongoCommandTimer()])
     except Exception as e:
         print(f"MongoDB connection error: {e}")  # Log to console instead of showing to user
         return None
 
+@st.cache_resource
+def bootstrap_database(_db, quote_retention):
+    """Opret indexes (inkl. TTL på quotes) én gang pr. proces i en baggrundstråd"""
+    def run():
+        try:
+            ensure_indexes(_db, quote_retention)
+        except Exception as e:
+            print(f"Database initialization error: {e}")
+
+    thread = threading.Thread(target=run, name="db-bootstrap", daemon=True)
+    thread.start()
+    return thread
+
 client = init_mongodb()
 db = None
 portfolio_collection = None
@@ -81,76 +109,489 @@ cash_collection = None
 dividends_collection = None
 
 if client:
+    db = client[DATABASE_NAME]
+    portfolio_collection = db["portfolio"]
+    transactions_collection = db["transactions"]
+    cash_collection = db["cash"]
+    dividends_collection = db["dividends"]
+
+# Parallel hentning af markedsdata
+FETCH_MAX_WORKERS = int(get_setting("MARKET_DATA_MAX_WORKERS", 8))
+FETCH_TIMEOUT = float(get_setting("MARKET_DATA_TIMEOUT", 10))
+
+def fetch_concurrently(fetch_fn, keys, max_workers=None, timeout=None):
+    """
+    Kør fetch_fn(key) parallelt i en begrænset trådpulje med deadline pr. key.
+    Returnerer (resultater, fejlede) - keys der fejler, giver None eller
+    overskrider deadline kommer i fejlede, så siden får delvise resultater
+    i stedet for at vente på det langsomste symbol.
+    """
+    keys = list(dict.fromkeys(keys))
+    results = {}
+    failed = []
+    timed_out = []
+    if not keys:
+        return results, failed
+
+    max_workers = max(1, min(max_workers or FETCH_MAX_WORKERS, len(keys)))
+    timeout = timeout or FETCH_TIMEOUT
+    ctx = get_script_run_ctx(suppress_warning=True)
+    started = {}
+
+    def attach_ctx():
+        # Giv worker-tråde Streamlit-konteksten, så st.cache_data virker i dem
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+
+    def run(key):
+        started[key] = time.monotonic()
+        return fetch_fn(key)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="marketdata",
+                                  initializer=attach_ctx)
+    futures = {executor.submit(run, key): key for key in keys}
+    pending = set(futures)
+    # Hårdt loft: hver runde af workers får højst `timeout` sekunder
+    hard_deadline = time.monotonic() + timeout * math.ceil(len(keys) / max_workers)
+
     try:
-        db = client["stock_portfolio"]
-        portfolio_collection = db["portfolio"]
-        transactions_collection = db["transactions"]
-        cash_collection = db["cash"]
-        dividends_collection = db["dividends"]
-        
-        # Initialize cash if not exists
-        if cash_collection.count_documents({}) == 0:
-            cash_collection.insert_one({"amount": 0.0, "currency": "DKK"})
+        while pending:
+            now = time.monotonic()
+            # En key der ikke er startet endnu kan tidligst udløbe om `timeout` sekunder
+            deadlines = [started[futures[f]] + timeout if futures[f] in started else now + timeout
+                         for f in pending]
+            wait_for = max(min(deadlines + [hard_deadline]) - now, 0)
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                key = futures[future]
+                try:
+                    value = future.result()
+                except Exception as e:
+                    print(f"[WARN] Hentning fejlede for {key}: {e}")
+                    value = None
+                if value is None:
+                    failed.append(key)
+                else:
+                    results[key] = value
+
+            now = time.monotonic()
+            if now >= hard_deadline:
+                expired = set(pending)
+            else:
+                expired = {f for f in pending
+                           if futures[f] in started and now - started[futures[f]] >= timeout}
+            for future in expired:
+                future.cancel()
+                timed_out.append(futures[future])
+            pending -= expired
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if timed_out:
+        print(f"[WARN] Timeout ved hentning af: {', '.join(map(str, timed_out))}")
+    return results, failed + timed_out
+
+@st.cache_resource
+def get_single_flight(name):
+    """Én single-flight pr. datatype og proces, delt af alle sessioner"""
+    return SingleFlight(wait_timeout=FETCH_TIMEOUT * 3)
+
+SINGLE_FLIGHTS = ("quotes", "securities", "dividends")
+
+# Alle kald til Yahoo går gennem én vagt: token bucket, backoff ved throttling og circuit breaker
+MARKET_DATA_RATE = float(get_setting("MARKET_DATA_RATE", 4))  # Kald pr. sekund
+MARKET_DATA_BURST = int(get_setting("MARKET_DATA_BURST", 8))
+BREAKER_THRESHOLD = int(get_setting("MARKET_DATA_BREAKER_THRESHOLD", 5))
+BREAKER_RESET = float(get_setting("MARKET_DATA_BREAKER_RESET", 60))
+
+@st.cache_resource
+def get_upstream():
+    return Upstream(
+        "yahoo",
+        TokenBucket(MARKET_DATA_RATE, MARKET_DATA_BURST),
+        CircuitBreaker(BREAKER_THRESHOLD, BREAKER_RESET),
+        acquire_timeout=FETCH_TIMEOUT / 2
+    )
+
+# Markedsdata-provider: yfinance, record (optag til fixtures) eller replay (offline med latenstid)
+MARKET_DATA_PROVIDER = get_setting("MARKET_DATA_PROVIDER", "yfinance")
+MARKET_DATA_FIXTURES = get_setting("MARKET_DATA_FIXTURES", "fixtures/market_data")
+MARKET_DATA_REPLAY_LATENCY = float(get_setting("MARKET_DATA_REPLAY_LATENCY", 0))  # Sekunder pr. kald
+MARKET_DATA_REPLAY_JITTER = float(get_setting("MARKET_DATA_REPLAY_JITTER", 0))
+
+@st.cache_resource
+def get_provider():
+    return create_provider(MARKET_DATA_PROVIDER, MARKET_DATA_FIXTURES,
+                           MARKET_DATA_REPLAY_LATENCY, MARKET_DATA_REPLAY_JITTER)
+
+@timed("market")
+def market_download(tickers, **kwargs):
+    return get_upstream().call(get_provider().download, list(tickers), **kwargs)
+
+def get_single_flight_stats():
+    """Udstedte og koalescerede upstream-hentninger pr. datatype i denne proces"""
+    return {name: get_single_flight(name).get_stats() for name in SINGLE_FLIGHTS}
+
+# Delt kurscache: proces-hukommelse -> MongoDB `quotes` -> yfinance
+QUOTE_TTL = int(get_setting("QUOTE_CACHE_TTL", 600))
+QUOTE_STALE_RETENTION = int(get_setting("QUOTE_STALE_RETENTION", 7 * 24 * 3600))  # Sidst kendte kurs gemmes så længe
+QUOTE_FAILURE_TTL = int(get_setting("QUOTE_FAILURE_TTL", 300))  # Fejlede symboler hentes ikke igen så længe
+
+if db is not None:
+    # Efter kurs-indstillingerne, da TTL-indexet på quotes følger QUOTE_STALE_RETENTION
+    bootstrap_database(db, max(QUOTE_STALE_RETENTION, QUOTE_TTL))
+
+class QuoteCache:
+    """
+    To-niveau cache for kurser keyed på Yahoo-symbol.
+    Niveau 1 er en dict i processen, niveau 2 er `quotes` collection i MongoDB
+    med TTL index (oprettet af db_indexes ved opstart), så alle replicas og genstarter deler én hentning pr. TTL-vindue.
+    Fejler en hentning, serveres sidst kendte værdi med dens alder (stale_age) i op til retention sekunder.
+    Fejlede symboler huskes i failure_ttl sekunder (højst ttl), så et ukendt eller afnoteret
+    symbol ikke koster en download ved hvert rerun
+    """
+
+    def __init__(self, collection, ttl, flight=None, retention=None, failure_ttl=None):
+        self.collection = collection
+        self.ttl = ttl
+        self.retention = max(retention or ttl, ttl)
+        self.failure_ttl = min(failure_ttl if failure_ttl is not None else ttl, ttl)
+        self.flight = flight
+        self._memory = {}  # symbol -> (fetched_at, data)
+        self._failures = {}  # symbol -> tidspunkt for sidste fejlede hentning
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "mongo_hits": 0, "misses": 0, "failure_hits": 0,
+                      "stale_served": 0, "max_stale_age": 0.0}
+
+    def remember(self, symbol, data, fetched_at=None):
+        """Gem kun i proces-hukommelsen (f.eks. fallback-værdier der ikke skal deles)"""
+        with self._lock:
+            self._memory[symbol] = (fetched_at or datetime.utcnow(), data)
+            self._failures.pop(symbol, None)
+
+    def remember_failed(self, symbols):
+        """Marker symboler som fejlede - de serveres som fejlede indtil markeringen udløber"""
+        now = datetime.utcnow()
+        cutoff = now - timedelta(seconds=self.failure_ttl)
+        with self._lock:
+            # Udløbne markeringer ryddes her, så dict'en ikke vokser med hvert ukendt symbol
+            for symbol in [s for s, failed_at in self._failures.items() if failed_at < cutoff]:
+                del self._failures[symbol]
+            for symbol in symbols:
+                self._failures[symbol] = now
+
+    def get_stale(self, symbol):
+        """Sidst kendte værdi uanset alder - returnerer (fetched_at, data) eller None"""
+        with self._lock:
+            return self._memory.get(symbol)
+
+    def get_stale_many(self, symbols):
+        """Sidst kendte værdier uanset friskhed fra hukommelse og MongoDB - {symbol: (fetched_at, data)}"""
+        with self._lock:
+            found = {s: self._memory[s] for s in symbols if s in self._memory}
+        missing = [s for s in symbols if s not in found]
+        if missing and self.collection is not None:
+            try:
+                for doc in self.collection.find({"_id": {"$in": missing}}):
+                    found[doc["_id"]] = (doc["fetched_at"], doc["data"])
+            except Exception as e:
+                print(f"[WARN] Kunne ikke læse quotes cache: {e}")
+        return found
+
+    def put_many(self, entries):
+        """Gem friske værdier i begge niveauer"""
+        if not entries:
+            return
+        now = datetime.utcnow()
+        for symbol, data in entries.items():
+            self.remember(symbol, data, now)
+        if self.collection is None:
+            return
+        try:
+            self.collection.bulk_write([
+                UpdateOne({"_id": symbol}, {"$set": {"data": data, "fetched_at": now}}, upsert=True)
+                for symbol, data in entries.items()
+            ], ordered=False)
+        except Exception as e:
+            print(f"[WARN] Kunne ikke skrive til quotes cache: {e}")
+
+    def get_many(self, symbols, fetch_missing):
+        """
+        Slå symboler op i hukommelse, så MongoDB, og hent resten med
+        fetch_missing(tuple) -> (data, fejlede). Returnerer (data, fejlede)
+        """
+        symbols = list(dict.fromkeys(s for s in symbols if s))
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        result = {}
+
+        with self._lock:
+            for symbol in symbols:
+                entry = self._memory.get(symbol)
+                if entry and entry[0] >= cutoff:
+                    result[symbol] = entry[1]
+            self.stats["memory_hits"] += len(result)
+
+        missing = [s for s in symbols if s not in result]
+        if missing and self.collection is not None:
+            try:
+                docs = self.collection.find({"_id": {"$in": missing}, "fetched_at": {"$gte": cutoff}})
+                for doc in docs:
+                    result[doc["_id"]] = doc["data"]
+                    self.remember(doc["_id"], doc["data"], doc["fetched_at"])
+                    with self._lock:
+                        self.stats["mongo_hits"] += 1
+            except Exception as e:
+                print(f"[WARN] Kunne ikke læse quotes cache: {e}")
+
+        missing = [s for s in missing if s not in result]
+        failed = []
+        if missing and self.failure_ttl > 0:
+            failure_cutoff = datetime.utcnow() - timedelta(seconds=self.failure_ttl)
+            with self._lock:
+                failed = [s for s in missing if self._failures.get(s, failure_cutoff) > failure_cutoff]
+                self.stats["failure_hits"] += len(failed)
+            missing = [s for s in missing if s not in failed]
+        if missing:
+            with self._lock:
+                self.stats["misses"] += len(missing)
+            def fetch_and_store(symbols):
+                fetched, failed = fetch_missing(symbols)
+                self.put_many(fetched)
+                if self.failure_ttl > 0:
+                    self.remember_failed(failed)
+                return fetched, failed
+
+            # Samtidige sessioner der mangler samme symbol venter på én hentning
+            if self.flight is not None:
+                fetched, fetch_failed = self.flight.do_many(missing, fetch_and_store)
+            else:
+                fetched, fetch_failed = fetch_and_store(tuple(missing))
+            result.update(fetched)
+            failed += fetch_failed
+
+        if failed:
+            # Stale-while-revalidate: sidst kendte værdi med alder i stedet for ingenting
+            now = datetime.utcnow()
+            for symbol, (fetched_at, data) in self.get_stale_many(failed).items():
+                age = (now - fetched_at).total_seconds()
+                result[symbol] = {**data, "stale_age": age}
+                with self._lock:
+                    self.stats["stale_served"] += 1
+                    self.stats["max_stale_age"] = max(self.stats["max_stale_age"], age)
+            failed = [s for s in failed if s not in result]
+        return result, failed
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["memory_hits"] + stats["mongo_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["mongo_hits"]) / lookups if lookups else 0.0
+        return stats
+
+@st.cache_resource
+def get_quote_cache():
+    return QuoteCache(db["quotes"] if db is not None else None, QUOTE_TTL, get_single_flight("quotes"),
+                      QUOTE_STALE_RETENTION, QUOTE_FAILURE_TTL)
+
+def get_quote_cache_stats():
+    """Hit/miss tællere for kurscachen i denne proces"""
+    return get_quote_cache().get_stats()
+
+def get_market_data_metrics():
+    """Throttles, breaker-tilstand og forældede kurser for markedsdata i denne proces"""
+    return {"upstream": get_upstream().get_metrics(), "quotes": get_quote_cache_stats()}
+
+# Valutamotor: alle par i én batched download, krydskurser via pivotvaluta
+FX_PIVOT = "USD"
+
+FALLBACK_RATES = {
+    "USD_DKK": 6.85,
+    "EUR_DKK": 7.45,
+    "GBP_DKK": 8.65,
+    "SEK_DKK": 0.64,
+    "NOK_DKK": 0.63,
+    "CHF_DKK": 7.85
+}
+
+def fx_symbol(from_currency, to_currency):
+    return f"{from_currency}{to_currency}=X"
+
+class FxRates:
+    """
+    Kurser fra et sæt valutaer til én basisvaluta, med status pr. valuta:
+    'fresh' (hentet inden for TTL), 'stale' (sidst kendte værdi) eller
+    'fallback' (hardcoded tabel).
+    """
+
+    def __init__(self, base, rates, status):
+        self.base = base
+        self.rates = rates
+        self.status = status
+
+    def rate(self, currency):
+        return self.rates.get(currency if isinstance(currency, str) and currency else self.base, 1.0)
+
+    def as_series(self):
+        return pd.Series(self.rates, dtype=float)
+
+    def vector(self, currencies):
+        """Kurs pr. element i en sekvens af valutaer - til array-baseret værdiansættelse"""
+        series = self.as_series()
+        currencies = pd.Index(pd.Series(list(currencies), dtype=object).fillna(self.base))
+        idx = series.index.get_indexer(currencies)
+        return np.where(idx >= 0, series.to_numpy()[idx], 1.0)
+
+    def degraded(self):
+        """Valutaer der ikke er serveret med en frisk kurs"""
+        return {c: s for c, s in self.status.items() if s != "fresh"}
+
+def fetch_fx_batch(symbols):
+    """Hent alle valutapar i én batched download - returnerer (data, fejlede)"""
+    try:
+        prices = download_last_prices(tuple(symbols))
     except Exception as e:
-        print(f"Database initialization error: {e}")
-        client = None
+        print(f"[WARN] Batch valutahentning fejlede: {e}")
+        prices = {}
+    result = {symbol: {'price': price} for symbol, price in prices.items() if price > 0}
+    return result, [symbol for symbol in symbols if symbol not in result]
+
+def fx_cache_symbols(currencies, base="DKK"):
+    """Fremmede valutaer og de cache-symboler der skal til: direkte par plus pivot-ben"""
+    foreign = sorted({c if isinstance(c, str) and c else base for c in currencies} - {base})
+    if not foreign:
+        return foreign, []
+    # Direkte par og pivot-ben hentes sammen, så der højst er ét upstream kald
+    symbols = [fx_symbol(c, base) for c in foreign]
+    symbols += [fx_symbol(FX_PIVOT, base)] + [fx_symbol(FX_PIVOT, c) for c in foreign if c != FX_PIVOT]
+    return foreign, symbols
+
+@timed("cache")
+def get_fx_rates(currencies, base="DKK"):
+    """Kurser for alle valutaer til base - direkte par, ellers krydskurs via FX_PIVOT"""
+    foreign, symbols = fx_cache_symbols(currencies, base)
+    rates = {base: 1.0}
+    status = {base: "fresh"}
+    if not foreign:
+        return FxRates(base, rates, status)
+
+    cache = get_quote_cache()
+    quotes, _ = cache.get_many(symbols, fetch_fx_batch)
+
+    pivot_to_base = quotes.get(fx_symbol(FX_PIVOT, base))
+    for currency in foreign:
+        direct = quotes.get(fx_symbol(currency, base))
+        pivot_to_currency = quotes.get(fx_symbol(FX_PIVOT, currency))
+        last_known = cache.get_stale(fx_symbol(currency, base))
+        # (alder, præference, kurs): den friskeste kilde vinder, ved lige alder det direkte par
+        candidates = []
+        if direct:
+            candidates.append((direct.get('stale_age') or 0, 0, direct['price']))
+        if pivot_to_base and pivot_to_currency:
+            # CUR->base = (PIVOT->base) / (PIVOT->CUR) - krydskursen er så gammel som sit ældste ben
+            age = max(pivot_to_base.get('stale_age') or 0, pivot_to_currency.get('stale_age') or 0)
+            candidates.append((age, 1, pivot_to_base['price'] / pivot_to_currency['price']))
+        if candidates:
+            age, _, rates[currency] = min(candidates)
+            status[currency] = "stale" if age else "fresh"
+        elif last_known:
+            rates[currency] = last_known[1]['price']
+            status[currency] = "stale"
+        else:
+            rates[currency] = FALLBACK_RATES.get(f"{currency}_{base}", 1.0)
+            status[currency] = "fallback"
+
+    fx = FxRates(base, rates, status)
+    if fx.degraded():
+        print(f"[WARN] Valutakurser ikke friske: {fx.degraded()}")
+    return fx
 
-# Cache for stock data and currency rates
-@st.cache_data(ttl=600)
 def get_exchange_rate(from_currency, to_currency="DKK"):
     if from_currency == to_currency:
         return 1.0
-    
-    try:
-        ticker = yf.Ticker(f"{from_currency}{to_currency}=X")
-        rate = ticker.history(period="1d")['Close'].iloc[-1]
-        return rate
-    except Exception:
-        fallback_rates = {
-            "USD_DKK": 6.85,
-            "EUR_DKK": 7.45,
-            "GBP_DKK": 8.65,
-            "SEK_DKK": 0.64,
-            "NOK_DKK": 0.63,
-            "CHF_DKK": 7.85
-        }
-        return fallback_rates.get(f"{from_currency}_{to_currency}", 1.0)
+    return get_fx_rates((from_currency,), to_currency).rate(from_currency)
 
-@st.cache_data(ttl=600)
-def get_stock_data(ticker_symbol):
+# Security master: metadata pr. symbol i `securities` collection, opdateres dagligt
+SECURITY_REFRESH_HOURS = float(get_setting("SECURITY_REFRESH_HOURS", 24))
+
+@timed("market")
+def fetch_security_info(ticker_symbol):
+    """Hent metadata fra den tunge ticker.info - navn, valuta og udbyttenøgletal"""
+    return security_from_info(ticker_symbol, get_upstream().call(get_provider().info, ticker_symbol))
+
+@st.cache_resource
+def get_security_master():
+    return SecurityMaster(db["securities"] if db is not None else None, fetch_security_info,
+                          SECURITY_REFRESH_HOURS, get_single_flight("securities"), fetch_concurrently)
+
+def get_securities(tickers, max_age_hours=None):
+    """Metadata for flere tickers fra security master - kun forældede hentes fra yfinance"""
+    return get_security_master().get(tickers, max_age_hours)
+
+def download_last_prices(tickers):
+    """Hent seneste lukkekurs for alle tickers i én samlet multi-symbol download"""
+    prices = {}
+    if not tickers:
+        return prices
+
+    # 5 dage så vi også har en kurs i weekender og på helligdage
+    data = market_download(tickers, period="5d", interval="1d", group_by="column",
+                           auto_adjust=False, progress=False, threads=True)
+    if data is None or data.empty:
+        return prices
+
+    closes = data['Close']
+    if isinstance(closes, pd.Series):  # Én ticker giver flade kolonner
+        closes = closes.to_frame(name=tickers[0])
+
+    for ticker in tickers:
+        if ticker in closes.columns:
+            series = closes[ticker].dropna()
+            if not series.empty:
+                prices[ticker] = float(series.iloc[-1])
+    return prices
+
+def fetch_quotes_batch(tickers_tuple):
+    """
+    Batched kursmotor: priser for alle tickers i ét kald, navn/valuta fra cache.
+    Returnerer (resultat, fejlede_tickers)
+    """
+    tickers = tuple(dict.fromkeys(t for t in tickers_tuple if t))
     try:
-        ticker = yf.Ticker(ticker_symbol)
-        history = ticker.history(period="1d")
-        
-        if not history.empty:
-            current_price = history['Close'].iloc[-1]
-            info = ticker.fast_info
-            currency = getattr(info, 'currency', 'DKK')
-            
-            full_info = ticker.info
-            stock_name = full_info.get('longName', full_info.get('shortName', ticker_symbol))
-            
-            return {
-                'price': current_price,
-                'currency': currency,
-                'name': stock_name
-            }
+        prices = download_last_prices(tickers)
     except Exception as e:
-        pass  # Silent fail - yfinance may have network issues on deployment
-    return None
+        print(f"[WARN] Batch kurshentning fejlede: {e}")
+        prices = {}
+
+    # Navn/valuta fra security master - kun for tickers der faktisk har en kurs
+    securities = get_securities([t for t in tickers if t in prices])
 
-@st.cache_data(ttl=600)
-def get_all_stocks_data_batch(tickers_tuple):
-    """Hent data for flere aktier med caching"""
     result = {}
-    for ticker in tickers_tuple:
-        try:
-            data = get_stock_data(ticker)
-            if data:
-                result[ticker] = data
-        except Exception as e:
-            pass  # Silent fail for better performance
-    return result
+    failed = []
+    for ticker in tickers:
+        security = securities.get(ticker, {})
+        if ticker not in prices or not security.get('currency'):
+            # Uden kendt valuta ville kursen blive gemt og handlet som DKK - prøv igen ved næste opslag
+            failed.append(ticker)
+            continue
+        result[ticker] = {
+            'price': prices[ticker],
+            'currency': security['currency'],
+            'name': security.get('name') or ticker
+        }
+
+    if failed:
+        print(f"[WARN] Ingen kurs eller valuta for: {', '.join(failed)}")
+    return result, failed
+
+def get_stock_data(ticker_symbol):
+    result, _ = get_quotes_batch((ticker_symbol,))
+    return result.get(ticker_symbol)
+
+@timed("cache")
+def get_quotes_batch(tickers_tuple):
+    """Hent kurser for flere aktier via den delte cache - returnerer (data, fejlede tickers)"""
+    return get_quote_cache().get_many(tickers_tuple, fetch_quotes_batch)
 
 def make_datetime_naive(dt):
     if dt is None:
@@ -163,161 +604,683 @@ def make_datetime_naive(dt):
 
 def get_cash_balance():
     try:
-        cash_doc = cash_collection.find_one({})
+        username = st.session_state.get("username")
+        cash_doc = cash_collection.find_one({"username": username})
         return cash_doc.get("amount", 0.0) if cash_doc else 0.0
     except Exception as e:
         st.error(f"Fejl ved hentning af saldo: {e}")
         return 0.0
 
-def get_portfolio_value():
-    total = 0.0
-    try:
-        username = st.session_state.get("username")
-        stocks = list(portfolio_collection.find({"username": username}))
-        tickers = tuple([stock['ticker'] for stock in stocks])
-        
-        stocks_data = get_all_stocks_data_batch(tickers)
-        
-        for stock in stocks:
-            ticker_symbol = stock['ticker']
-            shares = int(float(stock['shares'])) if stock['shares'] else 0
-            buy_price = float(stock['buy_price']) if stock['buy_price'] else 0.0
-            currency = stock.get('currency', 'DKK')
-            
-            # Try to get current price, fallback to buy price
-            if ticker_symbol in stocks_data:
-                data = stocks_data[ticker_symbol]
-                current_price = data['price']
-            else:
-                current_price = buy_price
-            
-            rate = get_exchange_rate(currency, "DKK")
-            total += current_price * shares * rate
-    except Exception as e:
-        st.error(f"Fejl ved beregning af portfolio værdi: {e}")
-    return total
+# Materialiseret oversigt pr. bruger i `portfolio_summary` - opdateres ved hver skrivning
+def summary_collection():
+    return db["portfolio_summary"] if db is not None else None
+
+@timed("compute")
+def rebuild_portfolio_summary(username):
+    """Byg brugerens oversigt ved replay af ledgeren (nyeste snapshot + senere events) - kun hvis den mangler"""
+    state = rebuild_user_state(db, username)
+    summary = {
+        "cash": state["cash"],
+        "positions": state_positions(state),
+        "last_event_id": state["last_event_id"],
+        # Ny generation ved hver genopbygning, så revision 0 aldrig genbruger et gammelt cacheresultat
+        "generation": str(ObjectId()),
+        "revision": 0,
+        "updated_at": datetime.now()
+    }
+    # $setOnInsert: en samtidig genopbygning må ikke overskrive en nyere oversigt
+    summary_collection().update_one({"_id": username}, {"$setOnInsert": summary}, upsert=True)
+    return summary_collection().find_one({"_id": username})
+
+def get_portfolio_summary(username):
+    """Én indekseret læsning af brugerens oversigt - genopbygges hvis den mangler"""
+    summary = summary_collection().find_one({"_id": username})
+    if summary is None:
+        summary = rebuild_portfolio_summary(username)
+    return summary
 
-def calculate_regular_dividend(ticker_symbol, div_data):
+def _apply_cash_to_summary(username, delta, session=None):
+    # Ingen upsert: mangler oversigten, bygges den fra kilden ved næste læsning
+    summary_collection().update_one(
+        {"_id": username},
+        {"$inc": {"cash": delta, "revision": 1}, "$set": {"updated_at": datetime.now()}},
+        session=session
+    )
+    invalidate_portfolio_state(username)
+
+def _apply_buy_to_summary(username, ticker, shares, price, currency, session=None):
+    """Læg et køb til positionen i oversigten (shares og kostpris er additive)"""
+    ticker_literal = {"$literal": ticker}
+    summary_collection().update_one(
+        {"_id": username},
+        [{"$set": {
+            "positions": {"$cond": [
+                {"$in": [ticker_literal, {"$ifNull": ["$positions.ticker", []]}]},
+                {"$map": {
+                    "input": "$positions",
+                    "as": "p",
+                    "in": {"$cond": [
+                        {"$eq": ["$$p.ticker", ticker_literal]},
+                        {"$mergeObjects": ["$$p", {
+                            "shares": {"$add": ["$$p.shares", shares]},
+                            "cost": {"$add": ["$$p.cost", price * shares]}
+                        }]},
+                        "$$p"
+                    ]}
+                }},
+                {"$concatArrays": [
+                    {"$ifNull": ["$positions", []]},
+                    [{"ticker": ticker_literal, "shares": shares, "cost": price * shares,
+                      "currency": {"$literal": currency}}]
+                ]}
+            ]},
+            "revision": {"$add": [{"$ifNull": ["$revision", 0]}, 1]},
+            "updated_at": datetime.now()
+        }}],
+        session=session
+    )
+    invalidate_portfolio_state(username)
+
+# Afledte resultater caches pr. (bruger, revision, kurs-epoke) og deles af alle sessioner i processen
+RESULT_CACHE_SIZE = int(get_setting("RESULT_CACHE_SIZE", 512))
+RESULT_DEGRADED_TTL = float(get_setting("RESULT_DEGRADED_TTL", 60))  # Resultater med fejlede/forældede data
+
+class ResultCache:
     """
-    FORBEDRET UDBYTTE LOGIK - Beregner KUN regelmæssige udbytter
+    LRU over beregnede resultater. Nøglen ændres når input ændres, så intet skal invalideres.
+    En post kan have en levetid (ttl sekunder) - bruges til resultater bygget på degraderede data
     """
-    try:
-        if not div_data:
-            return 0.0
-            
-        # METODE 1: Forward Dividend Rate (mest pålidelig)
-        info = div_data.get('info', {})
-        if not info:
-            return 0.0
-            
-        forward_dividend = info.get('dividendRate', None)
 
-        if forward_dividend and forward_dividend > 0:
-            return forward_dividend
+    def __init__(self, max_entries, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (udløber eller None, værdi)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
 
-        # METODE 2: Trailing Dividend Yield omregnet
-        trailing_yield = info.get('trailingAnnualDividendYield', None)
-        current_price = info.get('currentPrice', None)
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= self.clock():
+                del self._entries[key]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return True, entry[1]
+            self.stats["misses"] += 1
+            return False, None
 
-        if trailing_yield and current_price and current_price > 0:
-            trailing_dividend = trailing_yield * current_price
-            if trailing_dividend > 0:
-                return trailing_dividend
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (self.clock() + ttl if ttl is not None else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
 
-        # METODE 3: Beregn fra historik MED OUTLIER DETECTION
-        dividends = div_data.get('dividends', None)
-        if dividends is None or len(dividends) == 0:
-            return 0.0
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
-        if len(dividends) >= 4:  # Mindst 4 udbytter for god estimation
-            one_year_ago = datetime.now() - timedelta(days=365)
-            div_dates_naive = [make_datetime_naive(d) for d in dividends.index]
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries)}
 
-            # Find udbytter fra sidste år
-            last_year_divs = []
-            for i, div_date in enumerate(div_dates_naive):
-                if div_date and div_date > one_year_ago:
-                    last_year_divs.append(dividends.iloc[i])
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(RESULT_CACHE_SIZE)
 
-            if len(last_year_divs) >= 2:
-                # STATISTISK OUTLIER DETECTION
-                divs_array = np.array(last_year_divs)
+def quote_epoch():
+    """Kurs-epoke: skifter hvert QUOTE_TTL sekund - samme grænser i alle processer"""
+    return int(time.time() // QUOTE_TTL)
 
-                # Beregn Q1, Q3 og IQR (Interquartile Range)
-                q1 = np.percentile(divs_array, 25)
-                q3 = np.percentile(divs_array, 75)
-                iqr = q3 - q1
+# Live state: change streams lægger andre fanes og enheders skrivninger ind i hukommelsen
+LIVE_UPDATES_ENABLED = str(get_setting("LIVE_UPDATES_ENABLED", "true")).lower() in ("1", "true", "yes")
+LIVE_STATE_MAX_USERS = int(get_setting("LIVE_STATE_MAX_USERS", 1000))
 
-                # Outlier grænser: Q1 - 1.5*IQR og Q3 + 1.5*IQR
-                lower_bound = q1 - 1.5 * iqr
-                upper_bound = q3 + 1.5 * iqr
+@st.cache_resource
+def start_live_state():
+    """Én change stream-lytter pr. proces - slår sig selv fra på en standalone server"""
+    if not LIVE_UPDATES_ENABLED or db is None:
+        return None
+    return LiveStateCache(db, max_users=LIVE_STATE_MAX_USERS).start()
 
-                # Filtrer outliers (ekstraordinære udbytter)
-                regular_divs = [d for d in last_year_divs if lower_bound <= d <= upper_bound]
+def get_live_state_status():
+    if not st.session_state.get("logged_in"):
+        return None  # Lytteren startes først efter login
+    live = start_live_state()
+    return live.get_status() if live else None
 
-                if len(regular_divs) > 0:
-                    annual_dividend = sum(regular_divs)
-                    return annual_dividend
+def invalidate_portfolio_state(username):
+    # Egne skrivninger læses fra MongoDB ved næste rerun - lytteren kan være et par ms bagefter
+    st.session_state.pop("portfolio_state", None)
+    st.session_state.pop("rerun_results", None)
+    live = start_live_state()
+    if live:
+        live.drop(username)
 
-        # METODE 4: Sidste 4 kvartaler hvis data findes
-        if len(dividends) >= 4:
-            last_4 = dividends.iloc[-4:].values
+def _read_portfolio_state(username):
+    """Live state hvis lytteren kender brugeren, ellers oversigten fra MongoDB (som så seeder lytteren)"""
+    live = start_live_state()
+    if live is None:
+        return get_portfolio_summary(username)
+    state = live.get(username)
+    if state is not None:
+        return state
+    token = live.seed_token()
+    summary = get_portfolio_summary(username)
+    live.seed(username, summary, token)
+    return summary
 
-            # Tjek om de 4 seneste er relativt ensartede (ikke outliers)
-            median_val = np.median(last_4)
-            regular_vals = [d for d in last_4 if d < median_val * 2.5]
+def get_portfolio_state():
+    """Brugerens oversigt læst én gang pr. rerun - giver revisionsnøglen for alle afledte resultater"""
+    username = st.session_state.get("username")
+    rerun_id = st.session_state.get("rerun_id")
+    cached = st.session_state.get("portfolio_state")
+    if cached and cached["rerun_id"] == rerun_id and cached["username"] == username:
+        return cached["summary"]
+    summary = _read_portfolio_state(username)
+    st.session_state["portfolio_state"] = {"rerun_id": rerun_id, "username": username, "summary": summary}
+    return summary
 
-            if len(regular_vals) >= 3:
-                annual_dividend = sum(regular_vals) * (4 / len(regular_vals))
-                return annual_dividend
+def cached_result(kind, compute, cacheable=lambda result: True):
+    """
+    compute(summary) caches under (kind, bruger, generation, revision, kurs-epoke).
+    Resultater med fejlede eller forældede data (cacheable er falsk) caches kun i
+    RESULT_DEGRADED_TTL sekunder, så de prøves igen snart uden at hvert rerun regner forfra.
+    Inden for samme rerun beregnes de kun én gang, så et udfald ikke ganges op
+    """
+    summary = get_portfolio_state()
+    key = (kind, summary["_id"], summary.get("generation"), summary.get("revision", 0), quote_epoch())
+    rerun_id = st.session_state.get("rerun_id")
+    memo = st.session_state.get("rerun_results")
+    if not memo or memo["rerun_id"] != rerun_id:
+        memo = st.session_state["rerun_results"] = {"rerun_id": rerun_id, "results": {}}
+    if key in memo["results"]:
+        return memo["results"][key]
 
-        return 0.0
+    cache = get_result_cache()
+    hit, result = cache.get(key)
+    if not hit:
+        result = compute(summary)
+        cache.put(key, result, None if cacheable(result) else RESULT_DEGRADED_TTL)
+    memo["results"][key] = result
+    return result
+
+@timed("compute", "get_portfolio_valuation")
+def _value_portfolio(summary):
+    stocks = [
+        {**p, "buy_price": p["cost"] / p["shares"] if p.get("shares") else 0.0}
+        for p in summary.get("positions", [])
+    ]
+    holdings = build_holdings_frame(stocks)
+    quotes, failed = get_quotes_batch(tuple(holdings["ticker"]))
+    fx = get_fx_rates(holdings["currency"])
+    valued = value_holdings(holdings, quotes, fx.as_series())
 
+    return {
+        "username": summary["_id"],
+        "revision": summary.get("revision", 0),
+        "cash": summary.get("cash", 0.0),
+        "holdings": valued,
+        "summary": summarize_valuation(valued),
+        "failed_tickers": failed,
+        "stale_quotes": {t: q["stale_age"] for t, q in quotes.items() if q.get("stale_age")},
+        "fx": fx
+    }
+
+def _complete_valuation(valuation):
+    return not valuation["failed_tickers"] and not valuation["stale_quotes"] and not valuation["fx"].degraded()
+
+def get_portfolio_valuation():
+    """Værdiansættelse af brugerens beholdninger - beregnes kun når revision eller kurs-epoke skifter"""
+    return cached_result("valuation", _value_portfolio, _complete_valuation)
+
+def get_portfolio_value():
+    total = 0.0
+    try:
+        total = get_portfolio_valuation()["summary"]["value"]
     except Exception as e:
-        pass  # Silent fail - suppress yfinance errors
-    return 0.0
+        st.error(f"Fejl ved beregning af portfolio værdi: {e}")
+    return total
+
+# Lokalt udbyttelager i `dividends` collection - én dokument pr. ticker
+DIVIDEND_REFRESH_HOURS = float(get_setting("DIVIDEND_REFRESH_HOURS", 12))
+DIVIDEND_INFO_FIELDS = ('currency', 'dividendRate', 'trailingAnnualDividendYield', 'currentPrice')
 
-def get_dividend_data(ticker_symbol):
-    """Hent og cache dividend data"""
+@timed("market")
+def fetch_dividend_update(ticker_symbol, last_ex_date=None):
+    """Hent udbytter fra provideren - kun dem efter last_ex_date hvis den er kendt"""
+    if last_ex_date is None:
+        dividends = get_upstream().call(get_provider().dividends, ticker_symbol)
+    else:
+        start = last_ex_date + timedelta(days=1)
+        dividends = pd.Series(dtype=float)
+        if start.date() <= datetime.now().date():
+            dividends = get_upstream().call(get_provider().dividends, ticker_symbol, start)
+
+    payouts = [{"ex_date": make_datetime_naive(d), "amount": float(a)} for d, a in dividends.items()]
+    if last_ex_date is not None:
+        payouts = [p for p in payouts if p["ex_date"] > last_ex_date]
+    return payouts
+
+def refresh_dividend_history(ticker_symbol, doc=None):
+    """Tilføj nye udbytter efter high-water mark (last_ex_date) og gem i databasen"""
+    last_ex_date = doc.get("last_ex_date") if doc else None
     try:
-        ticker = yf.Ticker(ticker_symbol)
-        dividends = ticker.dividends
-        info = ticker.info
-        
-        return {
-            'dividends': dividends,
-            'info': info
-        }
-    except Exception:
-        return None
+        payouts = fetch_dividend_update(ticker_symbol, last_ex_date)
+    except Exception as e:
+        print(f"[WARN] Kunne ikke opdatere udbytter for {ticker_symbol}: {e}")
+        return doc  # Server det vi allerede har
+
+    update = {"$set": {"refreshed_at": datetime.utcnow()}}
+    if payouts:
+        update["$push"] = {"payouts": {"$each": payouts}}
+        update["$set"]["last_ex_date"] = max(p["ex_date"] for p in payouts)
+
+    if dividends_collection is None:
+        doc = dict(doc or {"ticker": ticker_symbol, "payouts": []})
+        doc["payouts"] = doc.get("payouts", []) + payouts
+        doc.update(update["$set"])
+        return doc
+
+    # Optimistisk samtidighed: kun hvis ingen andre har flyttet high-water mark siden vi læste.
+    # Kun en ny ticker oprettes med upsert - for et kendt dokument ville et tabt kapløb ellers
+    # indsætte et ekstra dokument med kun de nye udbytter, hvis det unikke index endnu ikke findes
+    try:
+        updated = dividends_collection.find_one_and_update(
+            {"ticker": ticker_symbol, "last_ex_date": last_ex_date}, update,
+            upsert=doc is None, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        updated = None  # En anden replica kom først - dens udbytter er allerede gemt
+    # Intet match: en anden har opdateret imens - læs deres version
+    return updated or dividends_collection.find_one({"ticker": ticker_symbol})
+
+def dividend_doc_to_data(doc, security):
+    payouts = doc.get("payouts") or []
+    dividends = pd.Series(
+        [p["amount"] for p in payouts],
+        index=pd.DatetimeIndex([p["ex_date"] for p in payouts]),
+        dtype=float
+    ).sort_index()
+    return {
+        'dividends': dividends,
+        'info': {field: security.get(field) for field in DIVIDEND_INFO_FIELDS} if security else {}
+    }
+
+@timed("cache")
+def get_dividend_data_batch(tickers, max_age_hours=None):
+    """Hent udbyttedata fra det lokale lager - kun forældede tickers opdateres fra yfinance"""
+    tickers = list(dict.fromkeys(tickers))
+    docs = {}
+    if dividends_collection is not None and tickers:
+        try:
+            docs = {doc["ticker"]: doc for doc in dividends_collection.find({"ticker": {"$in": tickers}})}
+        except Exception as e:
+            print(f"[WARN] Kunne ikke læse udbyttelager: {e}")
+
+    cutoff = datetime.utcnow() - timedelta(hours=max_age_hours or DIVIDEND_REFRESH_HOURS)
+    stale = [t for t in tickers if t not in docs or not docs[t].get("refreshed_at") or docs[t]["refreshed_at"] < cutoff]
+    flight = get_single_flight("dividends")
+    refreshed, _ = fetch_concurrently(lambda t: flight.do(t, lambda: refresh_dividend_history(t, docs.get(t))), stale)
+    docs.update(refreshed)
+
+    securities = get_securities(tickers)
+    return {t: dividend_doc_to_data(docs[t], securities.get(t)) for t in tickers if t in docs}
+
+def estimate_portfolio_dividends(tickers):
+    """Udbyttedata og årligt estimat pr. ticker for hele porteføljen i ét kald"""
+    div_data_map = get_dividend_data_batch(tickers)
+    payouts, info = build_dividend_frames(div_data_map)
+    annual = estimate_annual_dividends(payouts, info)
+    return div_data_map, payouts, info, annual
+
+@timed("compute")
+def get_upcoming_dividends():
+    """Fremskrevne udbetalinger de næste 12 måneder - caches sammen med værdiansættelsen"""
+    valuation = get_portfolio_valuation()
+    # Afledte resultater er kun så gode som værdiansættelsen de bygger på
+    return cached_result("upcoming_dividends", lambda summary: _project_upcoming_dividends(valuation["holdings"]),
+                         lambda result: _complete_valuation(valuation))
+
+def _project_upcoming_dividends(holdings):
+    _, payouts, div_info, annual = estimate_portfolio_dividends(holdings["ticker"].tolist())
+    fx = get_fx_rates(div_info["currency"])
+    prices = div_info["currentPrice"].rename("current_price")
+    positions = (
+        holdings.set_index("ticker")[["shares", "name"]]
+        .join(pd.Series(fx.vector(div_info["currency"]), index=div_info.index, name="fx_rate"))
+        .join(prices)
+    )
+    return project_upcoming_dividends(payouts, positions, annual)
+
+@timed("compute", "calculate_estimated_annual_dividend")
+def _estimate_annual_dividend(holdings):
+    _, _, info, annual = estimate_portfolio_dividends(holdings["ticker"].tolist())
+    fx = get_fx_rates(info["currency"])
+
+    annual_dkk = annual.clip(lower=0.0) * fx.vector(info["currency"])
+    return float((holdings["ticker"].map(annual_dkk).fillna(0.0) * holdings["shares"]).sum())
 
 def calculate_estimated_annual_dividend():
     total = 0.0
     try:
-        username = st.session_state.get("username")
-        stocks = list(portfolio_collection.find({"username": username}))
-        
-        for stock in stocks:
-            try:
-                ticker_symbol = stock['ticker']
-                div_data = get_dividend_data(ticker_symbol)
-                if not div_data:
-                    continue
-                
-                annual_dividend = calculate_regular_dividend(ticker_symbol, div_data)
-                
-                if annual_dividend > 0:
-                    info = div_data['info']
-                    currency = info.get('currency', 'DKK')
-                    rate = get_exchange_rate(currency, "DKK")
-                    shares = int(float(stock['shares'])) if stock['shares'] else 0
-                    total += annual_dividend * shares * rate
-            except Exception as e:
-                st.warning(f"Fejl ved udbytte for {stock['ticker']}: {e}")
+        valuation = get_portfolio_valuation()
+        total = cached_result("annual_dividend", lambda summary: _estimate_annual_dividend(valuation["holdings"]),
+                              lambda result: _complete_valuation(valuation))
     except Exception as e:
         st.error(f"Fejl ved samlet udbytte: {e}")
     return total
 
+# Baggrundsopvarmning: kurser, valuta og udbytter hentes før de udløber, så sider kun læser cache
+CACHE_WARM_INTERVAL = float(get_setting("CACHE_WARM_INTERVAL", QUOTE_TTL * 0.8))
+CACHE_WARMER_ENABLED = str(get_setting("CACHE_WARMER_ENABLED", "true")).lower() in ("1", "true", "yes")
+WARM_AHEAD = 0.8  # Udbytter og metadata fornyes når de har brugt denne andel af deres levetid
+
+class CacheWarmer:
+    """
+    Daemon-tråd der holder de delte caches varme for alle tickers og valutaer på tværs af brugere.
+    En lease i `locks` sørger for at kun én proces pr. interval henter fra yfinance -
+    de andre læser resultatet fra MongoDB
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.status = {"runs": 0, "skipped": 0, "errors": 0, "last_run": None, "last_duration": None}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name="cache-warmer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _acquire_lease(self):
+        if db is None:
+            return True
+        now = datetime.utcnow()
+        try:
+            db["locks"].update_one(
+                {"_id": "cache_warmer", "$or": [{"until": {"$lt": now}}, {"owner": self.owner}]},
+                {"$set": {"owner": self.owner, "until": now + timedelta(seconds=self.interval * 1.5)}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            return False  # En anden proces har lease
+
+    def run_once(self):
+        """Genopfrisk metadata, kurser, valuta og udbytter for alle tickers i porteføljerne"""
+        tickers = [t for t in portfolio_collection.distinct("ticker") if t]
+        securities = get_securities(tickers, max_age_hours=SECURITY_REFRESH_HOURS * WARM_AHEAD)
+
+        cache = get_quote_cache()
+        quotes, _ = fetch_quotes_batch(tuple(tickers))
+        cache.put_many(quotes)
+
+        currencies = set(portfolio_collection.distinct("currency"))
+        currencies |= {s.get("currency") for s in securities.values() if s.get("currency")}
+        _, fx_symbols = fx_cache_symbols(currencies)
+        if fx_symbols:
+            rates, _ = fetch_fx_batch(fx_symbols)
+            cache.put_many(rates)
+
+        get_dividend_data_batch(tickers, max_age_hours=DIVIDEND_REFRESH_HOURS * WARM_AHEAD)
+        return len(tickers), len(fx_symbols)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                if self._acquire_lease():
+                    self.run_once()
+                    self.status["runs"] += 1
+                    self.status["last_run"] = datetime.utcnow()
+                    self.status["last_duration"] = time.monotonic() - started
+                else:
+                    self.status["skipped"] += 1
+            except Exception as e:
+                self.status["errors"] += 1
+                print(f"[WARN] Cache-opvarmning fejlede: {e}")
+            self._stop.wait(max(self.interval - (time.monotonic() - started), 1.0))
+
+@st.cache_resource
+def start_cache_warmer():
+    """Én warmer-tråd pr. proces"""
+    if not CACHE_WARMER_ENABLED or portfolio_collection is None:
+        return None
+    return CacheWarmer(CACHE_WARM_INTERVAL).start()
+
+def get_cache_warmer_status():
+    if not st.session_state.get("logged_in"):
+        return None  # Warmeren startes først efter login
+    warmer = start_cache_warmer()
+    return dict(warmer.status) if warmer else None
+
+# Historisk udvikling: daglige lukkekurser og valutakurser i et lokalt Parquet-lager
+@st.cache_resource
+def get_price_store():
+    from price_history import PriceStore  # pyarrow indlæses først når Udvikling åbnes
+    return PriceStore(download=market_download)
+
+@timed("compute")
+def get_value_history(username):
+    """Daglig porteføljeværdi i DKK siden første transaktion. Returnerer (frame, manglende symboler)"""
+    from price_history import ledger_deltas, daily_portfolio_value
+    events = list(transactions_collection.find({"username": username}).sort("_id", 1))
+    shares, cash = ledger_deltas(events)
+    if shares.empty and cash.empty:
+        return daily_portfolio_value(shares, cash, pd.DataFrame(), pd.DataFrame()), []
+
+    tickers = list(dict.fromkeys(shares["ticker"]))
+    currencies = [c for c in dict.fromkeys(shares["currency"]) if c != "DKK"]
+    fx_symbols = [fx_symbol(c, "DKK") for c in currencies]
+    start = min(frame["date"].min() for frame in (shares, cash) if not frame.empty)
+
+    store = get_price_store()
+    missing = store.update(tickers + fx_symbols, start)
+    closes = store.read_many(tickers)
+    fx_closes = store.read_many(fx_symbols).rename(columns=dict(zip(fx_symbols, currencies)))
+    return daily_portfolio_value(shares, cash, closes, fx_closes), missing
+
+# Handel: kontant-tjek, position og transaktion i én MongoDB-transaktion
+transactions_supported = True
+
+def _as_number(field):
+    """Aggregation-udtryk der læser et felt som tal (gamle dokumenter har str)"""
+    return {"$convert": {"input": field, "to": "double", "onError": 0.0, "onNull": 0.0}}
+
+def _debit_cash(username, amount, session=None):
+    """Betinget træk på brugerens konto: lykkes kun hvis saldoen dækker hele beløbet"""
+    cash = cash_collection.find_one_and_update(
+        {"username": username, "amount": {"$gte": amount}},
+        {"$inc": {"amount": -amount}},
+        session=session
+    )
+    if cash is None:
+        return False
+    _apply_cash_to_summary(username, -amount, session=session)
+    return True
+
+def _credit_cash(username, amount, session=None):
+    """Indsæt på brugerens konto - kontoen oprettes hvis den ikke findes"""
+    cash_collection.update_one(
+        {"username": username},
+        {"$inc": {"amount": amount}, "$setOnInsert": {"currency": "DKK"}},
+        upsert=True,
+        session=session
+    )
+    _apply_cash_to_summary(username, amount, session=session)
+
+def _record_buy(username, ticker, shares, price, currency, total_cost, session=None, done=None):
+    """
+    Upsert af positionen (vægtet gennemsnitspris beregnes på serveren) og log i transaktioner.
+    done får navnet på hvert gennemført skridt, så en fejl uden transaktion kan kompenseres
+    """
+    done = [] if done is None else done
+    now = datetime.now()
+    portfolio_collection.update_one(
+        {"username": username, "ticker": ticker},
+        [
+            {"$set": {
+                "_old_shares": {"$trunc": _as_number("$shares")},
+                "_old_price": _as_number("$buy_price")
+            }},
+            {"$set": {
+                "shares": {"$toLong": {"$add": ["$_old_shares", shares]}},
+                "buy_price": {"$divide": [
+                    {"$add": [{"$multiply": ["$_old_price", "$_old_shares"]}, price * shares]},
+                    {"$add": ["$_old_shares", shares]}
+                ]},
+                "currency": {"$ifNull": ["$currency", currency]},
+                "buy_date": {"$ifNull": ["$buy_date", now]}
+            }},
+            {"$unset": ["_old_shares", "_old_price"]}
+        ],
+        upsert=True,
+        session=session
+    )
+    done.append("position")
+    event_id = ObjectId()
+    transactions_collection.insert_one({
+        "_id": event_id,
+        "username": username,
+        "type": "buy",
+        "ticker": ticker,
+        "shares": shares,
+        "price": price,
+        "currency": currency,
+        "total": total_cost,
+        "date": now
+    }, session=session)
+    done.append(("ledger", event_id))
+    _apply_buy_to_summary(username, ticker, shares, price, currency, session=session)
+
+def _undo_buy(username, ticker, shares, price, done):
+    """Kompensér de skridt af et køb der nåede at blive skrevet (kun uden transaktioner)"""
+    for step in reversed(done):
+        if step == "position":
+            # Omvendt af den vægtede gennemsnitspris: (pris*antal - købspris*købt) / (antal - købt)
+            portfolio_collection.update_one(
+                {"username": username, "ticker": ticker},
+                [
+                    {"$set": {
+                        "_new_shares": _as_number("$shares"),
+                        "_old_shares": {"$subtract": [_as_number("$shares"), shares]}
+                    }},
+                    {"$set": {
+                        "shares": {"$toLong": "$_old_shares"},
+                        "buy_price": {"$cond": [
+                            {"$gt": ["$_old_shares", 0]},
+                            {"$divide": [
+                                {"$subtract": [{"$multiply": [_as_number("$buy_price"), "$_new_shares"]},
+                                               price * shares]},
+                                "$_old_shares"
+                            ]},
+                            _as_number("$buy_price")
+                        ]}
+                    }},
+                    {"$unset": ["_new_shares", "_old_shares"]}
+                ]
+            )
+            portfolio_collection.delete_one({"username": username, "ticker": ticker, "shares": {"$lte": 0}})
+        else:
+            transactions_collection.delete_one({"_id": step[1]})
+    # Oversigten er afledt - genopbygges fra ledgeren ved næste læsning
+    summary_collection().delete_one({"_id": username})
+    invalidate_portfolio_state(username)
+
+def run_in_transaction(write):
+    """
+    Kør write(session) i en transaktion med retry. Returnerer (kørt, resultat) -
+    kørt er False på en standalone server, hvor kalderen selv må kompensere
+    """
+    global transactions_supported
+    if transactions_supported:
+        try:
+            with client.start_session() as session:
+                return True, session.with_transaction(write)
+        except OperationFailure as e:
+            # Standalone mongod understøtter ikke transaktioner (code 20: IllegalOperation)
+            if e.code != 20:
+                raise
+            print("[WARN] MongoDB understøtter ikke transaktioner - bruger kompenserende skrivninger")
+            transactions_supported = False
+    return False, None
+
+def execute_cash(username, kind, amount):
+    """
+    Indsæt (deposit) eller hæv (withdrawal) og log eventet i ledgeren i samme transaktion.
+    Returnerer False hvis saldoen ikke dækker en hævning
+    """
+    delta = amount if kind == "deposit" else -amount
+
+    def apply_cash(session=None):
+        if kind == "deposit":
+            _credit_cash(username, amount, session=session)
+            return True
+        return _debit_cash(username, amount, session=session)
+
+    def log_event(session=None):
+        transactions_collection.insert_one({
+            "username": username,
+            "type": kind,
+            "amount": amount,
+            "date": datetime.now()
+        }, session=session)
+
+    def cash_in_transaction(session):
+        if not apply_cash(session):
+            return False
+        log_event(session)
+        return True
+
+    ran, ok = run_in_transaction(cash_in_transaction)
+    if not ran:
+        ok = apply_cash()
+        if ok:
+            try:
+                log_event()
+            except Exception:
+                # Ledgeren er sandheden - uden event må saldoen heller ikke ændres
+                _credit_cash(username, -delta)
+                raise
+    return ok
+
+def execute_buy(username, ticker, shares, price, currency, total_cost):
+    """
+    Udfør et køb atomisk: træk kontanter betinget, opdater position og log transaktionen.
+    Returnerer (succes, besked)
+    """
+    def buy_in_transaction(session):
+        if not _debit_cash(username, total_cost, session=session):
+            return False
+        _record_buy(username, ticker, shares, price, currency, total_cost, session=session)
+        return True
+
+    ran, ok = run_in_transaction(buy_in_transaction)
+    if not ran:
+        ok = _debit_cash(username, total_cost)
+        if ok:
+            done = []
+            try:
+                _record_buy(username, ticker, shares, price, currency, total_cost, done=done)
+            except Exception:
+                # Rul position og ledger tilbage og giv kontanterne tilbage før fejlen vises
+                _undo_buy(username, ticker, shares, price, done)
+                _credit_cash(username, total_cost)
+                raise
+
+    if not ok:
+        return False, f"Ikke nok kontanter! Du har {get_cash_balance():,.2f} DKK"
+    return True, None
+
 def create_user(username, password):
     """Create a new user in the database"""
     try:
@@ -335,27 +1298,21 @@ def create_user(username, password):
             "password": password,
             "created_at": datetime.now()
         })
+        _credit_cash(username, 0.0)
         
         return True, f"Bruger '{username}' oprettet successfully!"
     except Exception as e:
         return False, f"Fejl ved oprettelse af bruger: {e}"
 
+@timed("page")
 def show_dashboard():
     st.title("📊 Dashboard")
     
-    # Use session state for caching calculations
-    cache_key = "dashboard_data"
-    if cache_key not in st.session_state:
-        st.session_state[cache_key] = {
-            "cash_balance": get_cash_balance(),
-            "portfolio_value": get_portfolio_value(),
-            "annual_dividend": calculate_estimated_annual_dividend()
-        }
-    
-    data = st.session_state[cache_key]
-    cash_balance = data["cash_balance"]
-    portfolio_value = data["portfolio_value"]
-    annual_dividend = data["annual_dividend"]
+    # Oversigten holdes opdateret ved hver skrivning og omvurderes mod kurscachen her
+    valuation = get_portfolio_valuation()
+    cash_balance = valuation["cash"]
+    portfolio_value = valuation["summary"]["value"]
+    annual_dividend = calculate_estimated_annual_dividend()
     total_value = cash_balance + portfolio_value
     
     col1, col2, col3, col4 = st.columns(4)
@@ -376,103 +1333,35 @@ def show_dashboard():
     
     # Allocation chart
     try:
-        username = st.session_state.get("username")
-        stocks = list(portfolio_collection.find({"username": username}))
-        if stocks:
-            tickers = tuple([stock['ticker'] for stock in stocks])
-            stocks_data = get_all_stocks_data_batch(tickers)
-            
-            labels = []
-            values = []
-            
-            for stock in stocks:
-                ticker_symbol = stock['ticker']
-                shares = int(float(stock['shares'])) if stock['shares'] else 0
-                buy_price = float(stock['buy_price']) if stock['buy_price'] else 0.0
-                currency = stock.get('currency', 'DKK')
-                
-                # Try to get current price, fallback to buy price
-                if ticker_symbol in stocks_data:
-                    data = stocks_data[ticker_symbol]
-                    current_price = data['price']
-                else:
-                    current_price = buy_price
-                
-                rate = get_exchange_rate(currency, "DKK")
-                value = current_price * shares * rate
-                labels.append(ticker_symbol)
-                values.append(value)
-            
-            if values:
-                fig = go.Figure(data=[go.Pie(labels=labels, values=values, textinfo="label+percent")])
-                fig.update_layout(title="Aktiefordeling", height=500)
-                st.plotly_chart(fig, width='stretch')
-    except Exception:
-        pass
+        import plotly.graph_objects as go
+        holdings = get_portfolio_valuation()["holdings"]
+        if not holdings.empty:
+            fig = go.Figure(data=[go.Pie(labels=holdings["ticker"], values=holdings["value"], textinfo="label+percent")])
+            fig.update_layout(title="Aktiefordeling", height=500)
+            st.plotly_chart(fig, width='stretch')
+    except Exception as e:
+        record_error("page", "show_dashboard.allocation", e)
 
+@timed("page")
 def show_stocks():
     st.title("📈 Mine Aktier")
     
     try:
-        username = st.session_state.get("username")
-        stocks = list(portfolio_collection.find({"username": username}))
-        
-        if not stocks:
+        valuation = get_portfolio_valuation()
+        holdings = valuation["holdings"]
+
+        if holdings.empty:
             st.info("Ingen aktier i portfolio")
             return
-        
-        # Fetch current prices for stocks from yfinance (optional enhancement)
-        tickers = tuple([stock['ticker'] for stock in stocks])
-        stocks_data = get_all_stocks_data_batch(tickers)
-        
-        stock_list = []
-        total_profit_loss = 0.0
-        total_buy_value = 0.0
-        total_current_value = 0.0
-        
-        for stock in stocks:
-            ticker_symbol = stock['ticker']
-            shares = int(float(stock['shares'])) if stock['shares'] else 0  # Handle both str and int
-            buy_price = float(stock['buy_price']) if stock['buy_price'] else 0.0  # Handle both str and float
-            currency = stock.get('currency', 'DKK')
-            
-            # Try to get current price from yfinance, fallback to buy price if unavailable
-            if ticker_symbol in stocks_data:
-                data = stocks_data[ticker_symbol]
-                current_price = data['price']
-                stock_name = data.get('name', ticker_symbol)
-            else:
-                # Fallback: use buy price (data from MongoDB is reliable)
-                current_price = buy_price
-                stock_name = ticker_symbol
-            
-            rate = get_exchange_rate(currency, "DKK")
-            
-            current_price_dkk = current_price * rate
-            buy_price_dkk = buy_price * rate
-            
-            current_value = current_price_dkk * shares
-            buy_value = buy_price_dkk * shares
-            profit_loss = current_value - buy_value
-            profit_loss_pct = (profit_loss / buy_value) * 100 if buy_value > 0 else 0
-            
-            total_profit_loss += profit_loss
-            total_buy_value += buy_value
-            total_current_value += current_value
-            
-            stock_list.append({
-                "Navn": stock_name[:25],
-                "Ticker": ticker_symbol,
-                "Antal": shares,
-                "Købskurs": f"{buy_price_dkk:.2f}",
-                "Nuværende": f"{current_price_dkk:.2f}",
-                "Værdi": f"{current_value:,.2f}",
-                "Gevinst/Tab": f"{profit_loss:,.2f}",
-                "Gevinst %": f"{profit_loss_pct:.2f}%"
-            })
-        
-        # Display summary
-        total_profit_pct = (total_profit_loss / total_buy_value) * 100 if total_buy_value > 0 else 0
+
+        summary = valuation["summary"]
+        failed_tickers = valuation["failed_tickers"]
+        fx = valuation["fx"]
+
+        total_profit_loss = summary["profit_loss"]
+        total_buy_value = summary["cost"]
+        total_current_value = summary["value"]
+        total_profit_pct = summary["profit_loss_pct"]
         
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -489,15 +1378,35 @@ def show_stocks():
             )
         
         st.divider()
-        
-        if stock_list:
-            df = pd.DataFrame(stock_list)
-            st.dataframe(df, width='stretch', hide_index=True)
-        else:
-            st.info("Ingen aktier data tilgængelig")
+
+        if failed_tickers:
+            st.caption(f"⚠️ Ingen aktuel kurs for {', '.join(failed_tickers)} - viser købskurs")
+        stale_quotes = valuation["stale_quotes"]
+        if stale_quotes:
+            details = ", ".join(f"{t} ({age / 60:.0f} min)" for t, age in stale_quotes.items())
+            st.caption(f"⚠️ Sidst kendte kurs vises for: {details}")
+        degraded_fx = fx.degraded()
+        if degraded_fx:
+            fx_labels = {"stale": "sidst kendte kurs", "fallback": "fast reservekurs"}
+            details = ", ".join(f"{c} ({fx_labels[status]})" for c, status in degraded_fx.items())
+            st.caption(f"⚠️ Valutakurser ikke opdaterede: {details}")
+
+        # Formatering sker først ved visning - beregningerne holdes som tal
+        df = pd.DataFrame({
+            "Navn": holdings["name"].astype(str).str[:25],
+            "Ticker": holdings["ticker"],
+            "Antal": holdings["shares"],
+            "Købskurs": holdings["buy_price_dkk"].map("{:.2f}".format),
+            "Nuværende": holdings["current_price_dkk"].map("{:.2f}".format),
+            "Værdi": holdings["value"].map("{:,.2f}".format),
+            "Gevinst/Tab": holdings["profit_loss"].map("{:,.2f}".format),
+            "Gevinst %": holdings["profit_loss_pct"].map("{:.2f}%".format)
+        })
+        st.dataframe(df, width='stretch', hide_index=True)
     except Exception as e:
         st.error(f"Fejl ved hentning af aktier: {e}")
 
+@timed("page")
 def show_buy_stocks():
     st.title("🛒 Køb Aktier")
     
@@ -525,44 +1434,10 @@ def show_buy_stocks():
                     rate = get_exchange_rate(currency, "DKK")
                     total_cost = current_price * shares * rate
                     
-                    cash_balance = get_cash_balance()
-                    if total_cost > cash_balance:
-                        st.error(f"Ikke nok kontanter! Du har {cash_balance:,.2f} DKK")
+                    ok, message = execute_buy(username, ticker, shares, current_price, currency, total_cost)
+                    if not ok:
+                        st.error(message)
                     else:
-                        existing = portfolio_collection.find_one({"username": username, "ticker": ticker})
-                        if existing:
-                            existing_shares = int(float(existing['shares'])) if existing['shares'] else 0
-                            existing_buy_price = float(existing['buy_price']) if existing['buy_price'] else 0.0
-                            new_total_shares = existing_shares + shares
-                            new_avg_price = ((existing_buy_price * existing_shares) +
-                                            (current_price * shares)) / new_total_shares
-                            portfolio_collection.update_one(
-                                {"username": username, "ticker": ticker},
-                                {"$set": {"shares": new_total_shares, "buy_price": new_avg_price}}
-                            )
-                        else:
-                            portfolio_collection.insert_one({
-                                "username": username,
-                                "ticker": ticker,
-                                "shares": shares,
-                                "buy_price": current_price,
-                                "currency": currency,
-                                "buy_date": datetime.now()
-                            })
-                        
-                        cash_collection.update_one({}, {"$inc": {"amount": -total_cost}})
-                        
-                        transactions_collection.insert_one({
-                            "username": username,
-                            "type": "buy",
-                            "ticker": ticker,
-                            "shares": shares,
-                            "price": current_price,
-                            "currency": currency,
-                            "total": total_cost,
-                            "date": datetime.now()
-                        })
-                        
                         st.success(f"✅ Købte {shares} {ticker} for {total_cost:,.2f} DKK")
                         st.rerun()
     
@@ -586,61 +1461,19 @@ def show_buy_stocks():
                     rate = get_exchange_rate(currency, "DKK")
                     total_cost = old_price * old_shares * rate
                     
-                    cash_balance = get_cash_balance()
-                    if total_cost > cash_balance:
-                        st.error(f"Ikke nok kontanter! Du har {cash_balance:,.2f} DKK")
+                    ok, message = execute_buy(username, old_ticker, old_shares, old_price, currency, total_cost)
+                    if not ok:
+                        st.error(message)
                     else:
-                        existing = portfolio_collection.find_one({"username": username, "ticker": old_ticker})
-                        if existing:
-                            existing_shares = int(float(existing['shares'])) if existing['shares'] else 0
-                            existing_buy_price = float(existing['buy_price']) if existing['buy_price'] else 0.0
-                            new_total_shares = existing_shares + old_shares
-                            new_avg_price = ((existing_buy_price * existing_shares) +
-                                            (old_price * old_shares)) / new_total_shares
-                            portfolio_collection.update_one(
-                                {"username": username, "ticker": old_ticker},
-                                {"$set": {"shares": new_total_shares, "buy_price": new_avg_price}}
-                            )
-                        else:
-                            portfolio_collection.insert_one({
-                                "username": username,
-                                "ticker": old_ticker,
-                                "shares": old_shares,
-                                "buy_price": old_price,
-                                "currency": currency,
-                                "buy_date": datetime.now()
-                            })
-                        
-                        cash_collection.update_one({}, {"$inc": {"amount": -total_cost}})
-                        
-                        transactions_collection.insert_one({
-                            "username": username,
-                            "type": "buy",
-                            "ticker": old_ticker,
-                            "shares": old_shares,
-                            "price": old_price,
-                            "currency": currency,
-                            "total": total_cost,
-                            "date": datetime.now()
-                        })
-                        
                         st.success(f"✅ Tilføjede {old_shares} {old_ticker}")
                         st.rerun()
 
+@timed("page")
 def show_dividends():
     st.title("💰 Udbytter")
     
-    # Use session state to cache dividend calculations
-    cache_key = "dividends_data"
-    
-    if cache_key not in st.session_state:
-        # Calculate once and store
-        st.session_state[cache_key] = {
-            "annual": calculate_estimated_annual_dividend(),
-            "upcoming": None  # Will calculate on demand
-        }
-    
-    annual_dividend = st.session_state[cache_key]["annual"]
+    # Caches pr. portfolio-revision og kurs-epoke - et køb eller en indbetaling giver nye tal
+    annual_dividend = calculate_estimated_annual_dividend()
     monthly_avg = annual_dividend / 12 if annual_dividend > 0 else 0
     
     col1, col2 = st.columns(2)
@@ -653,106 +1486,64 @@ def show_dividends():
     st.subheader("📅 Kommende Udbytter (næste 12 måneder)")
     
     try:
-        username = st.session_state.get("username")
-        stocks = list(portfolio_collection.find({"username": username}))
-        if not stocks:
+        holdings = get_portfolio_valuation()["holdings"]
+        if holdings.empty:
             st.info("Ingen aktier i portfolio")
             return
         
-        tickers = tuple([stock['ticker'] for stock in stocks])
-        stocks_data = get_all_stocks_data_batch(tickers)
-        
-        dividends_list = []
-        
-        for stock in stocks:
-            ticker_symbol = stock['ticker']
-            shares = int(float(stock['shares'])) if stock['shares'] else 0
-            stock_name = stocks_data.get(ticker_symbol, {}).get('name', ticker_symbol)
-            
-            div_data = get_dividend_data(ticker_symbol)
-            if not div_data:
-                continue
-            
-            dividends = div_data.get('dividends')
-            if dividends is None or len(dividends) == 0:
-                continue
-            
-            if len(dividends) >= 3:
-                div_dates_naive = [make_datetime_naive(d) for d in dividends.index]
-                
-                last_div_date = div_dates_naive[-1]
-                two_years_ago = datetime.now() - timedelta(days=730)
-                
-                if last_div_date < two_years_ago:
-                    continue
-                
-                recent_dates = div_dates_naive[-min(5, len(div_dates_naive)):]
-                
-                intervals = []
-                for i in range(1, len(recent_dates)):
-                    interval = (recent_dates[i] - recent_dates[i-1]).days
-                    if interval > 0:
-                        intervals.append(interval)
-                
-                if not intervals:
-                    continue
-                
-                intervals.sort()
-                median_interval = intervals[len(intervals)//2]
-                
-                if median_interval > 300:
-                    expected_payments = 1
-                elif median_interval > 150:
-                    expected_payments = 2
-                elif median_interval > 60:
-                    expected_payments = 4
-                else:
-                    expected_payments = 12
-                
-                if median_interval < 400:
-                    annual_dividend_stock = calculate_regular_dividend(ticker_symbol, div_data)
-                    
-                    if annual_dividend_stock > 0:
-                        info = div_data.get('info', {})
-                        currency = info.get('currency', 'DKK')
-                        rate = get_exchange_rate(currency, "DKK")
-                        current_price = info.get('currentPrice', 0)
-                        
-                        dividend_per_payment = annual_dividend_stock / expected_payments
-                        
-                        current_date = last_div_date
-                        one_year_from_now = datetime.now() + timedelta(days=365)
-                        payment_count = 0
-                        payment_delay = 25
-                        
-                        while current_date < one_year_from_now and payment_count < expected_payments:
-                            current_date = current_date + timedelta(days=median_interval)
-                            
-                            if current_date > datetime.now() and current_date <= one_year_from_now:
-                                amount = dividend_per_payment * shares * rate
-                                payment_date = current_date + timedelta(days=payment_delay)
-                                
-                                price_dkk = current_price * rate if current_price else 0
-                                dividends_list.append({
-                                    "Selskab": f"{stock_name} ({ticker_symbol})",
-                                    "Pris": f"{price_dkk:.2f} DKK",
-                                    "Udbetalingsdato": payment_date.strftime('%d/%m/%Y'),
-                                    "Beløb": f"{amount:,.2f} DKK"
-                                })
-                                payment_count += 1
-        
-        if dividends_list:
-            df = pd.DataFrame(dividends_list)
-            df['Sort_Date'] = pd.to_datetime(df['Udbetalingsdato'], format='%d/%m/%Y')
-            df = df.sort_values('Sort_Date').drop('Sort_Date', axis=1)
-            
+        projection = get_upcoming_dividends()
+
+        if not projection.empty:
+            df = pd.DataFrame({
+                "Selskab": projection["name"].astype(str) + " (" + projection["ticker"] + ")",
+                "Pris": projection["price_dkk"].map("{:.2f} DKK".format),
+                "Udbetalingsdato": projection["payment_date"].dt.strftime('%d/%m/%Y'),
+                "Beløb": projection["amount_dkk"].map("{:,.2f} DKK".format)
+            })
             st.dataframe(df, width='stretch', hide_index=True)
+
+            import plotly.graph_objects as go
+            monthly = monthly_dividend_cashflow(projection)
+            fig = go.Figure(data=[go.Bar(x=monthly.index.strftime('%b %Y'), y=monthly.values)])
+            fig.update_layout(title="Forventet udbytte pr. måned (DKK)", height=400)
+            st.plotly_chart(fig, width='stretch')
         else:
             st.info("❌ Ingen kommende udbytter fundet")
     
-    except Exception:
-        pass
+    except Exception as e:
+        record_error("page", "show_dividends.upcoming", e)
+
+@timed("page")
+def show_history():
+    st.title("📈 Udvikling")
+
+    try:
+        history, missing = get_value_history(st.session_state.get("username"))
+    except Exception as e:
+        st.error(f"Fejl ved beregning af udvikling: {e}")
+        return
+    if history.empty:
+        st.info("Ingen transaktioner endnu")
+        return
+    if missing:
+        st.caption(f"⚠️ Ingen kurshistorik for: {', '.join(missing)} - værdisat til 0")
 
+    first, last = history["total"].iloc[0], history["total"].iloc[-1]
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("Total Værdi", f"{last:,.2f} DKK")
+    with col2:
+        st.metric("Siden Start", f"{last - first:+,.2f} DKK")
+
+    import plotly.graph_objects as go
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=history.index, y=history["total"], name="Total", mode="lines"))
+    fig.add_trace(go.Scatter(x=history.index, y=history["holdings"], name="Aktier", mode="lines"))
+    fig.add_trace(go.Scatter(x=history.index, y=history["cash"], name="Kontanter", mode="lines"))
+    fig.update_layout(title="Porteføljeværdi pr. dag (DKK)", height=500, hovermode="x unified")
+    st.plotly_chart(fig, width='stretch')
+
+@timed("page")
 def show_cash_management():
     st.title("🏦 Kontanthåndtering")
     
@@ -769,13 +1560,7 @@ def show_cash_management():
         
         if st.button("Indsæt"):
             if deposit_amount > 0:
-                cash_collection.update_one({}, {"$inc": {"amount": deposit_amount}})
-                transactions_collection.insert_one({
-                    "username": username,
-                    "type": "deposit",
-                    "amount": deposit_amount,
-                    "date": datetime.now()
-                })
+                execute_cash(username, "deposit", deposit_amount)
                 st.success(f"✅ Indsat {deposit_amount:,.2f} DKK")
                 st.rerun()
             else:
@@ -787,14 +1572,7 @@ def show_cash_management():
         
         if st.button("Hæv"):
             if withdraw_amount > 0:
-                if withdraw_amount <= cash_balance:
-                    cash_collection.update_one({}, {"$inc": {"amount": -withdraw_amount}})
-                    transactions_collection.insert_one({
-                        "username": username,
-                        "type": "withdrawal",
-                        "amount": withdraw_amount,
-                        "date": datetime.now()
-                    })
+                if execute_cash(username, "withdrawal", withdraw_amount):
                     st.success(f"✅ Hævet {withdraw_amount:,.2f} DKK")
                     st.rerun()
                 else:
@@ -802,6 +1580,102 @@ def show_cash_management():
             else:
                 st.error("Beløb skal være større end 0")
 
+# Ydelse: spans pr. rerun til admin-panelet og kumulerede metrics til Prometheus
+ADMIN_USERS = {u.strip() for u in str(get_setting("ADMIN_USERS", "")).split(",") if u.strip()}
+METRICS_FILE = get_setting("METRICS_FILE", "metrics.prom")
+METRICS_DUMP_INTERVAL = float(get_setting("METRICS_DUMP_INTERVAL", 15))
+
+def _rerun_spans():
+    return st.session_state.get("spans") if get_script_run_ctx(suppress_warning=True) is not None else None
+
+registry.rerun_sink = _rerun_spans
+
+def collect_gauges():
+    """Cache-, single-flight- og upstream-tal som flade gauges"""
+    metrics = get_market_data_metrics()
+    upstream = metrics["upstream"]
+    gauges = {f"portfolio_quote_cache_{k}": v for k, v in metrics["quotes"].items()}
+    gauges.update({f"portfolio_upstream_{k}": v for k, v in upstream.items() if k != "breaker_state"})
+    gauges["portfolio_upstream_breaker_open"] = 0 if upstream["breaker_state"] == "closed" else 1
+    for name, stats in get_single_flight_stats().items():
+        gauges.update({f"portfolio_singleflight_{name}_{k}": v for k, v in stats.items()})
+    gauges.update({f"portfolio_result_cache_{k}": v for k, v in get_result_cache().get_stats().items()})
+    live = get_live_state_status()
+    if live:
+        gauges["portfolio_live_state_up"] = 1 if live["state"] == "live" else 0
+        gauges.update({f"portfolio_live_state_{k}": live[k] for k in ("events", "applied", "resets", "users")})
+    warmer = get_cache_warmer_status()
+    if warmer:
+        gauges.update({f"portfolio_cache_warmer_{k}": warmer[k] for k in ("runs", "skipped", "errors")})
+        if warmer["last_run"]:
+            gauges["portfolio_cache_warmer_last_run_age_seconds"] = (datetime.utcnow() - warmer["last_run"]).total_seconds()
+            gauges["portfolio_cache_warmer_last_duration_seconds"] = warmer["last_duration"]
+    return gauges
+
+@st.cache_resource
+def _metrics_dump_state():
+    return {"last": 0.0, "lock": threading.Lock()}
+
+def dump_metrics():
+    """Skriv Prometheus-filen højst hvert METRICS_DUMP_INTERVAL sekund - først efter login"""
+    if not METRICS_FILE or not st.session_state.get("logged_in"):
+        return  # Gauges opretter caches og tråde, som login-siden ikke skal vente på
+    state = _metrics_dump_state()
+    if time.monotonic() - state["last"] < METRICS_DUMP_INTERVAL or not state["lock"].acquire(blocking=False):
+        return
+    try:
+        state["last"] = time.monotonic()
+        write_prometheus(METRICS_FILE, collect_gauges())
+    except Exception as e:
+        print(f"[WARN] Kunne ikke skrive metrics: {e}")
+    finally:
+        state["lock"].release()
+
+def show_performance_panel():
+    """Sidebar-panel for admins: langsomste spans i denne rerun, cache hit rates og upstream kald"""
+    spans = st.session_state.get("spans") or []
+    metrics = get_market_data_metrics()
+    with st.sidebar.expander("⏱️ Ydelse"):
+        pages = [s for s in spans if s["kind"] == "page"]
+        if pages:
+            st.caption(f"Side: {pages[-1]['name']} på {pages[-1]['duration'] * 1000:.0f} ms")
+        by_kind = {}
+        for s in spans:
+            by_kind[s["kind"]] = by_kind.get(s["kind"], 0.0) + s["duration"]
+        st.caption(" · ".join(f"{kind} {total * 1000:.0f} ms" for kind, total in sorted(by_kind.items())))
+
+        slowest = sorted(spans, key=lambda s: s["duration"], reverse=True)[:10]
+        if slowest:
+            st.dataframe(pd.DataFrame({
+                "Type": [s["kind"] for s in slowest],
+                "Navn": [s["name"] for s in slowest],
+                "ms": [round(s["duration"] * 1000, 1) for s in slowest]
+            }), hide_index=True)
+
+        quotes = metrics["quotes"]
+        upstream = metrics["upstream"]
+        flights = get_single_flight_stats()
+        st.caption(f"Kurscache: {quotes['hit_rate']:.0%} hits, {quotes['stale_served']} forældede serveret, "
+                   f"{quotes['failure_hits']} kendte fejl ikke hentet igen")
+        st.caption(f"Upstream: {upstream['calls']} kald, {upstream['throttles']} throttles, "
+                   f"breaker {upstream['breaker_state']}")
+        st.caption("Single-flight: " + ", ".join(
+            f"{name} {stats['issued']}/{stats['coalesced']}" for name, stats in flights.items()
+        ) + " (udstedt/koalesceret)")
+        results = get_result_cache().get_stats()
+        st.caption(f"Resultatcache: {results['hits']} hits, {results['misses']} misses, "
+                   f"{results['entries']} poster")
+        live = get_live_state_status()
+        if live:
+            st.caption(f"Live opdateringer: {live['state']}, {live['users']} brugere, "
+                       f"{live['applied']} deltaer anvendt")
+        warmer = get_cache_warmer_status()
+        if warmer:
+            last_run = (f"sidst for {(datetime.utcnow() - warmer['last_run']).total_seconds():.0f}s siden "
+                        f"på {warmer['last_duration']:.1f}s") if warmer["last_run"] else "ikke kørt endnu"
+            st.caption(f"Cache-warmer: {warmer['runs']} kørsler, {warmer['skipped']} sprunget over "
+                       f"(anden proces har lease), {warmer['errors']} fejl, {last_run}")
+
 # Main app navigation
 def show_login():
     """Login page"""
@@ -847,6 +1721,7 @@ def show_login():
                             if user and user.get("password") == password:
                                 st.session_state.logged_in = True
                                 st.session_state.username = username
+                                st.session_state.is_admin = bool(user.get("is_admin")) or username in ADMIN_USERS
                                 st.rerun()
                             else:
                                 st.error("❌ Brugernavn eller adgangskode er forkert")
@@ -889,11 +1764,18 @@ def main():
     # Initialize session state
     if "logged_in" not in st.session_state:
         st.session_state.logged_in = False
+    # Nyt id pr. rerun, så beregninger kan deles inden for samme kørsel
+    st.session_state.rerun_id = st.session_state.get("rerun_id", 0) + 1
+    st.session_state.spans = []
     
     # Show login or main app
     if not st.session_state.logged_in:
         show_login()
     else:
+        # Warmeren og lytteren startes først efter login, så de ikke konkurrerer med login-siden
+        start_cache_warmer()
+        start_live_state()
+
         # Sidebar with logout
         st.sidebar.title("🏠 Aktieportfolio Manager")
         
@@ -903,12 +1785,14 @@ def main():
         
         st.sidebar.markdown("---")
         
-        page = st.sidebar.radio("Navigation", ["Dashboard", "Mine Aktier", "Køb Aktier", "Udbytter", "Kontanter"])
+        page = st.sidebar.radio("Navigation", ["Dashboard", "Mine Aktier", "Udvikling", "Køb Aktier", "Udbytter", "Kontanter"])
         
         if page == "Dashboard":
             show_dashboard()
         elif page == "Mine Aktier":
             show_stocks()
+        elif page == "Udvikling":
+            show_history()
         elif page == "Køb Aktier":
             show_buy_stocks()
         elif page == "Udbytter":
@@ -916,5 +1800,9 @@ def main():
         elif page == "Kontanter":
             show_cash_management()
 
+        if st.session_state.get("is_admin"):
+            show_performance_panel()
+    dump_metrics()
+
 if __name__ == "__main__":
     main()
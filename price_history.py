@@ -0,0 +1,206 @@
+"""
+Historisk porteføljeværdi: lokalt kolonnebaseret kurslager (Parquet, memory-mapped) og
+vektoriseret daglig værdi som shares-matrix × kurs-matrix over ledgeren
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from market_data import YFinanceProvider
+
+PRICE_STORE_DIR = os.getenv("PRICE_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".price_store"))
+PRICE_STORE_REFRESH_HOURS = 6  # Så ofte spørges yfinance om nye lukkekurser pr. symbol
+
+SCHEMA = pa.schema([("date", pa.timestamp("ns")), ("close", pa.float64())])
+
+class PriceStore:
+    """Daglige lukkekurser pr. symbol i hver sin Parquet-fil - udvides kun med nye dage"""
+
+    def __init__(self, root=PRICE_STORE_DIR, download=None):
+        self.root = root
+        self.download = download or YFinanceProvider().download
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, symbol):
+        safe = "".join(c if c.isalnum() or c in "-_." else "_" for c in symbol)
+        return os.path.join(self.root, f"{safe}.parquet")
+
+    def read(self, symbol):
+        """Lukkekurser som Series indekseret på dato (tom hvis symbolet ikke er hentet)"""
+        path = self.path(symbol)
+        if not os.path.exists(path):
+            return pd.Series(dtype="float64", index=pd.DatetimeIndex([], name="date"), name=symbol)
+        table = pq.read_table(path, memory_map=True)
+        frame = table.to_pandas()
+        return frame.set_index("date")["close"].rename(symbol)
+
+    def read_many(self, symbols):
+        """Wide frame dato × symbol"""
+        if not symbols:
+            return pd.DataFrame(index=pd.DatetimeIndex([], name="date"))
+        return pd.concat([self.read(symbol) for symbol in symbols], axis=1).sort_index()
+
+    def covered_from(self, symbol):
+        """Tidligste dato upstream er spurgt fra (før børsnotering findes der ingen kurser) - None hvis ukendt"""
+        path = self.path(symbol)
+        if not os.path.exists(path):
+            return None
+        metadata = pq.read_schema(path, memory_map=True).metadata or {}
+        if b"covered_from" in metadata:
+            return pd.Timestamp(metadata[b"covered_from"].decode())
+        first = self.read(symbol).index.min()
+        return None if pd.isna(first) else first
+
+    def append(self, symbol, closes, covered_from=None):
+        """Flet nye dage ind (før eller efter de kendte) - skrives til en temp-fil og byttes atomisk ind"""
+        existing = self.read(symbol)
+        closes = closes.dropna()
+        closes = closes[~closes.index.isin(existing.index)]
+        combined = pd.concat([existing, closes]).sort_index() if not closes.empty else existing
+        covered = [d for d in (self.covered_from(symbol), covered_from) if d is not None]
+        frame = pd.DataFrame({"date": combined.index.astype("datetime64[ns]"), "close": combined.to_numpy(dtype="float64")})
+        table = pa.Table.from_pandas(frame, schema=SCHEMA, preserve_index=False)
+        if covered:
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                                   b"covered_from": min(covered).isoformat().encode()})
+        path = self.path(symbol)
+        tmp_path = f"{path}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+
+    def _download_closes(self, symbols, start, end=None):
+        """Lukkekurser dato × symbol fra én samlet download"""
+        kwargs = {"end": end.strftime("%Y-%m-%d")} if end is not None else {}
+        data = self.download(symbols, start=start.strftime("%Y-%m-%d"), interval="1d", group_by="column",
+                             auto_adjust=False, progress=False, threads=True, **kwargs)
+        closes = data["Close"] if data is not None and not data.empty else pd.DataFrame()
+        if isinstance(closes, pd.Series):  # Én ticker giver flade kolonner
+            closes = closes.to_frame(name=symbols[0])
+        if getattr(closes.index, "tz", None) is not None:
+            closes.index = closes.index.tz_localize(None)
+        return closes
+
+    def backfill(self, symbols, start):
+        """
+        Hent [start, covered_from) for symboler der kun er hentet fra en senere dato - lageret deles
+        af alle brugere, så en bruger med ældre handler ellers ville få den første kendte kurs bagud.
+        Returnerer symboler der ikke kunne hentes
+        """
+        start = pd.Timestamp(start).normalize()
+        missing = {s: self.covered_from(s) for s in symbols}
+        missing = {s: d for s, d in missing.items() if d is not None and d > start}
+        if not missing:
+            return []
+        try:
+            closes = self._download_closes(list(missing), start, max(missing.values()))
+        except Exception as e:
+            print(f"[WARN] Kunne ikke hente ældre kurshistorik: {e}")
+            return list(missing)
+        for symbol, covered in missing.items():
+            series = closes[symbol] if symbol in closes.columns else pd.Series(dtype="float64")
+            self.append(symbol, series[series.index < covered], covered_from=start)
+        return []
+
+    def stale_symbols(self, symbols, max_age_hours=PRICE_STORE_REFRESH_HOURS):
+        """Symboler hvis fil mangler eller ikke er tjekket inden for max_age_hours"""
+        cutoff = time.time() - max_age_hours * 3600
+        return [s for s in symbols if not os.path.exists(self.path(s)) or os.path.getmtime(self.path(s)) < cutoff]
+
+    def update(self, symbols, start):
+        """
+        Hent manglende dage for forældede symboler i én samlet download fra det tidligste behov,
+        og ældre dage for symboler der ikke dækker start. Returnerer symboler der ikke kunne hentes
+        """
+        stale = self.stale_symbols(symbols)  # Før backfill, som også rører filerne
+        failed = self.backfill(symbols, start)
+        if not stale:
+            return failed
+
+        last_dates = [self.read(s).index.max() for s in stale]
+        if any(pd.isna(d) for d in last_dates):
+            fetch_from = pd.Timestamp(start).normalize()
+        else:
+            fetch_from = min(last_dates) + timedelta(days=1)
+        if fetch_from > pd.Timestamp(datetime.now()).normalize():
+            for symbol in stale:
+                os.utime(self.path(symbol))
+            return failed
+
+        try:
+            closes = self._download_closes(stale, fetch_from)
+        except Exception as e:
+            print(f"[WARN] Kunne ikke hente kurshistorik: {e}")
+            return sorted(set(failed) | set(stale))
+
+        for symbol in stale:
+            if symbol in closes.columns:
+                existed = os.path.exists(self.path(symbol))
+                self.append(symbol, closes[symbol], covered_from=None if existed else fetch_from)
+            elif os.path.exists(self.path(symbol)):
+                os.utime(self.path(symbol))  # Intet nyt - marker som tjekket
+            else:
+                failed.append(symbol)
+        return failed
+
+def ledger_deltas(events):
+    """
+    Ledger-events som to frames: aktie-ændringer (date, ticker, shares, currency)
+    og kontant-ændringer (date, amount)
+    """
+    share_rows, cash_rows = [], []
+    for event in events:
+        kind = event.get("type")
+        date = pd.Timestamp(event.get("date") or event["_id"].generation_time.replace(tzinfo=None)).normalize()
+        if kind == "buy":
+            share_rows.append((date, event["ticker"], float(event.get("shares") or 0), event.get("currency") or "DKK"))
+            cash_rows.append((date, -float(event.get("total") or 0)))
+        elif kind == "deposit":
+            cash_rows.append((date, float(event.get("amount") or 0)))
+        elif kind == "withdrawal":
+            cash_rows.append((date, -float(event.get("amount") or 0)))
+        elif kind == "adjustment":
+            if event.get("ticker"):
+                share_rows.append((date, event["ticker"], float(event.get("shares") or 0), event.get("currency") or "DKK"))
+            cash_rows.append((date, float(event.get("amount") or 0)))
+    shares = pd.DataFrame(share_rows, columns=["date", "ticker", "shares", "currency"])
+    cash = pd.DataFrame(cash_rows, columns=["date", "amount"])
+    return shares, cash
+
+def _daily(frame, days):
+    """Reindekser til kalenderdage: fremført over weekender/helligdage og tilbage til første kurs"""
+    return frame.reindex(frame.index.union(days)).ffill().bfill().reindex(days)
+
+def daily_portfolio_value(shares, cash, closes, fx_closes, end=None):
+    """
+    Daglig værdi i DKK fra første transaktion til end.
+    closes: dato × ticker i handelsvaluta, fx_closes: dato × valuta (kurs til DKK).
+    Returnerer DataFrame med holdings, cash og total pr. kalenderdag
+    """
+    end = pd.Timestamp(end or datetime.now()).normalize()
+    starts = [frame["date"].min() for frame in (shares, cash) if not frame.empty]
+    if not starts:
+        return pd.DataFrame(columns=["holdings", "cash", "total"], dtype="float64")
+    days = pd.date_range(min(starts), end, freq="D", name="date")
+
+    tickers = list(dict.fromkeys(shares["ticker"]))
+    currency = shares.groupby("ticker")["currency"].first().reindex(tickers)
+
+    # Beholdning pr. dag: kumuleret sum af ændringer (dage × tickers)
+    share_matrix = (
+        shares.pivot_table(index="date", columns="ticker", values="shares", aggfunc="sum")
+        .reindex(index=days, columns=tickers).fillna(0.0).cumsum().to_numpy()
+    )
+    price_matrix = _daily(closes.reindex(columns=tickers), days).fillna(0.0).to_numpy()
+    fx = _daily(fx_closes, days)
+    fx["DKK"] = 1.0
+    fx_matrix = fx.reindex(columns=currency.to_numpy()).fillna(1.0).to_numpy()
+
+    holdings = np.einsum("ij,ij->i", share_matrix, price_matrix * fx_matrix)
+    cash_series = cash.groupby("date")["amount"].sum().reindex(days, fill_value=0.0).cumsum()
+    return pd.DataFrame({"holdings": holdings, "cash": cash_series.to_numpy(), "total": holdings + cash_series.to_numpy()}, index=days)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""Bulk-opdatering af security master (navn, valuta, udbyttenøgletal) for alle tickers"""
+
+import os
+
+from pymongo import MongoClient
+
+from market_data import create_provider
+from resilience import CircuitBreaker, TokenBucket, Upstream
+from securities import SecurityMaster, security_from_info
+
+def main():
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    client = MongoClient(os.getenv("MONGODB_CONNECTION_STRING"), serverSelectionTimeoutMS=15000)
+    db = client[os.getenv("MONGODB_DATABASE", "stock_portfolio")]
+    provider = create_provider(os.getenv("MARKET_DATA_PROVIDER", "yfinance"),
+                               os.getenv("MARKET_DATA_FIXTURES", "fixtures/market_data"))
+    # Samme vagt som appen: jobbet må ikke få Yahoo til at throttle de kørende sessioner
+    upstream = Upstream("yahoo",
+                        TokenBucket(float(os.getenv("MARKET_DATA_RATE", 4)), int(os.getenv("MARKET_DATA_BURST", 8))),
+                        CircuitBreaker(int(os.getenv("MARKET_DATA_BREAKER_THRESHOLD", 5)),
+                                       float(os.getenv("MARKET_DATA_BREAKER_RESET", 60))))
+    master = SecurityMaster(db["securities"],
+                            lambda ticker: security_from_info(ticker, upstream.call(provider.info, ticker)))
+
+    print("[DEBUG] Opdaterer security master...")
+    fetched, failed = master.refresh_all(db["portfolio"])
+    print(f"[✓] Opdaterede {len(fetched)} værdipapirer")
+    if failed:
+        print(f"[!] Fejlede: {', '.join(failed)}")
+
+if __name__ == "__main__":
+    main()
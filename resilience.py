@@ -0,0 +1,196 @@
+"""
+Robust upstream-adgang: token bucket, eksponentiel backoff og circuit breaker.
+Ur, sleep og jitter kan injiceres, så det hele kan køres mod en lokal falsk provider
+"""
+
+import random
+import threading
+import time
+
+THROTTLE_MARKERS = ("429", "too many requests", "rate limit")
+
+class ThrottledError(Exception):
+    """Upstream har afvist kaldet pga. rate limiting"""
+
+class CircuitOpenError(Exception):
+    """Breakeren er åben - upstream kaldes ikke før reset_timeout er gået"""
+
+def is_throttle(error):
+    if isinstance(error, ThrottledError):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+def _transient_errors():
+    # requests indlæses først ved første fejl - ikke når modulet importeres
+    try:
+        from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout as RequestsTimeout
+        return (ConnectionError, TimeoutError, RequestsConnectionError, RequestsTimeout)
+    except ImportError:
+        return (ConnectionError, TimeoutError)
+
+def is_transient(error):
+    """Fejl hvor et nyt forsøg kan hjælpe - alt andet (ukendt ticker osv.) er et svar fra upstream"""
+    return is_throttle(error) or isinstance(error, _transient_errors())
+
+class TokenBucket:
+    """rate tokens pr. sekund, op til capacity i burst"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self):
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self, timeout=None):
+        """Vent på et token - False hvis det ikke kan nås inden timeout"""
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - self.clock()
+                if remaining < wait:
+                    return False
+            self.sleep(wait)
+
+class CircuitBreaker:
+    """
+    closed -> open efter failure_threshold fejl i træk. Efter reset_timeout går den i
+    half_open og lader ét prøvekald igennem: succes lukker den, fejl åbner den igen
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def release(self):
+        """Et tilladt kald blev aldrig sendt - frigiv half_open-prøven til næste kald"""
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+            self._probing = False
+
+class Upstream:
+    """Rate limit, retry med backoff og circuit breaker omkring alle kald til én upstream"""
+
+    def __init__(self, name, bucket, breaker, max_retries=2, base_delay=0.5, max_delay=8.0,
+                 acquire_timeout=5.0, sleep=time.sleep, jitter=random.random):
+        self.name = name
+        self.bucket = bucket
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.acquire_timeout = acquire_timeout
+        self.sleep = sleep
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        self.metrics = {"calls": 0, "failures": 0, "throttles": 0, "retries": 0,
+                        "short_circuits": 0, "rate_limited": 0}
+
+    def _count(self, metric):
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def backoff(self, attempt):
+        """Eksponentiel backoff med jitter: base * 2^attempt, skaleret til 50-100%"""
+        return min(self.max_delay, self.base_delay * 2 ** attempt) * (0.5 + self.jitter() / 2)
+
+    def call(self, fn, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            # Breakeren først: en åben breaker må ikke bruge tokens eller vente på dem
+            if not self.breaker.allow():
+                self._count("short_circuits")
+                raise CircuitOpenError(f"{self.name}: circuit breaker åben")
+            if not self.bucket.acquire(self.acquire_timeout):
+                self.breaker.release()
+                self._count("rate_limited")
+                raise ThrottledError(f"{self.name}: lokal rate limit")
+
+            self._count("calls")
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_transient(e):
+                    # Upstream svarede - fejlen ligger i forespørgslen, ikke i forbindelsen
+                    self.breaker.record_success()
+                    raise
+                if is_throttle(e):
+                    self._count("throttles")
+                self.breaker.record_failure()
+                if attempt == self.max_retries or self.breaker.state != CircuitBreaker.CLOSED:
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                self.sleep(self.backoff(attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+    def get_metrics(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+        metrics["breaker_state"] = self.breaker.state
+        metrics["consecutive_failures"] = self.breaker.failures
+        return metrics
@@ -0,0 +1,92 @@
+"""
+Security master: metadata pr. symbol (navn, valuta, udbyttenøgletal) i `securities` collection.
+Uden UI, så både appen og bulk-jobbet (refresh_securities.py) kan bruge det
+"""
+
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+SECURITY_REFRESH_HOURS = 24
+
+def security_from_info(ticker_symbol, info):
+    """Felterne vi gemmer fra den tunge ticker.info - None hvis upstream intet svarede"""
+    if not info:
+        return None
+    return {
+        'name': info.get('longName', info.get('shortName', ticker_symbol)),
+        'currency': info.get('currency'),  # Ingen gæt - uden valuta kan kursen ikke prissættes
+        'dividendRate': info.get('dividendRate'),
+        'trailingAnnualDividendYield': info.get('trailingAnnualDividendYield'),
+        'currentPrice': info.get('currentPrice')
+    }
+
+def fetch_sequentially(fetch_fn, keys):
+    """Simpel fetch_many: ét kald ad gangen - returnerer (resultater, fejlede)"""
+    results, failed = {}, []
+    for key in keys:
+        try:
+            value = fetch_fn(key)
+        except Exception as e:
+            print(f"[WARN] Hentning fejlede for {key}: {e}")
+            value = None
+        if value is None:
+            failed.append(key)
+        else:
+            results[key] = value
+    return results, failed
+
+class SecurityMaster:
+    """
+    fetch_info(ticker) henter metadata upstream. fetch_many(fn, keys) bestemmer hvordan
+    flere hentes (appen bruger sin parallelle trådpulje), og flight koalescerer samtidige hentninger
+    """
+
+    def __init__(self, collection, fetch_info, refresh_hours=SECURITY_REFRESH_HOURS,
+                 flight=None, fetch_many=fetch_sequentially):
+        self.collection = collection
+        self.fetch_info = fetch_info
+        self.refresh_hours = refresh_hours
+        self.flight = flight
+        self.fetch_many = fetch_many
+
+    def refresh(self, tickers):
+        """Hent metadata for tickers og gem i security master - returnerer (data, fejlede)"""
+        def fetch(missing):
+            return self.fetch_many(self.fetch_info, missing)
+
+        fetched, failed = self.flight.do_many(tickers, fetch) if self.flight else fetch(list(tickers))
+        if fetched and self.collection is not None:
+            now = datetime.utcnow()
+            try:
+                self.collection.bulk_write([
+                    UpdateOne({"_id": ticker}, {"$set": {**data, "refreshed_at": now}}, upsert=True)
+                    for ticker, data in fetched.items()
+                ], ordered=False)
+            except Exception as e:
+                print(f"[WARN] Kunne ikke gemme security master: {e}")
+        return fetched, failed
+
+    def get(self, tickers, max_age_hours=None):
+        """Metadata for flere tickers - kun manglende og forældede hentes upstream"""
+        tickers = list(dict.fromkeys(t for t in tickers if t))
+        securities = {}
+        if self.collection is not None and tickers:
+            try:
+                for doc in self.collection.find({"_id": {"$in": tickers}}):
+                    securities[doc.pop("_id")] = doc
+            except Exception as e:
+                print(f"[WARN] Kunne ikke læse security master: {e}")
+
+        cutoff = datetime.utcnow() - timedelta(hours=max_age_hours or self.refresh_hours)
+        stale = [t for t in tickers
+                 if t not in securities or not securities[t].get("refreshed_at") or securities[t]["refreshed_at"] < cutoff]
+        if stale:
+            fetched, _ = self.refresh(stale)
+            securities.update(fetched)  # Ved fejl bruges den gamle metadata hvis den findes
+        return securities
+
+    def refresh_all(self, portfolio_collection):
+        """Bulk-job: opdater security master for alle tickers på tværs af brugere"""
+        tickers = portfolio_collection.distinct("ticker") if portfolio_collection is not None else []
+        return self.refresh(tickers)
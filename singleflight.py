@@ -0,0 +1,71 @@
+"""Single-flight: samtidige identiske hentninger venter på én igangværende og deler resultatet"""
+
+import threading
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+class SingleFlight:
+    """
+    Koalescerer hentninger pr. nøgle på tværs af tråde (Streamlit-sessioner) i processen.
+    Tællere: issued = nøgler hentet upstream, coalesced = nøgler der ventede på en anden tråds hentning
+    """
+
+    def __init__(self, wait_timeout=30.0):
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {"issued": 0, "coalesced": 0}
+
+    def _claim(self, keys):
+        """Del nøgler i dem denne tråd skal hente og dem en anden tråd allerede henter"""
+        own, waiting = {}, {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                if key in self._calls:
+                    waiting[key] = self._calls[key]
+                else:
+                    own[key] = self._calls[key] = _Call()
+            self.stats["issued"] += len(own)
+            self.stats["coalesced"] += len(waiting)
+        return own, waiting
+
+    def _release(self, own, results):
+        with self._lock:
+            for key, call in own.items():
+                call.result = results.get(key)
+                self._calls.pop(key, None)
+                call.done.set()
+
+    def do(self, key, fn):
+        """fn() køres højst én gang ad gangen pr. nøgle - samtidige kald får samme resultat"""
+        results = self.do_many([key], lambda keys: ({key: fn()}, []))[0]
+        return results.get(key)
+
+    def do_many(self, keys, fetch_many):
+        """
+        Batch-variant: fetch_many(tuple) -> (data, fejlede) kaldes kun med nøgler der ikke
+        allerede er undervejs. Returnerer (data, fejlede) for alle nøgler
+        """
+        own, waiting = self._claim(keys)
+        results = {}
+        if own:
+            try:
+                fetched, _ = fetch_many(tuple(own))
+                results.update({k: v for k, v in fetched.items() if k in own and v is not None})
+            finally:
+                self._release(own, results)
+
+        for key, call in waiting.items():
+            if call.done.wait(self.wait_timeout) and call.result is not None:
+                results[key] = call.result
+        failed = [key for key in dict.fromkeys(keys) if key not in results]
+        return results, failed
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Modulerne ligger fladt i roden af repoet
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,51 @@
+"""Falsk markedsdata-provider til testene - fejl kan injiceres før hvert kald"""
+
+import threading
+
+import pandas as pd
+
+from market_data import MarketDataProvider, join_download
+
+class FakeProvider(MarketDataProvider):
+    """
+    Lokal falsk provider til test af vagten: faste kurser og info, og de næste kald kan
+    sættes til at fejle med throttling (429) eller forbindelsesfejl
+    """
+
+    name = "fake"
+
+    def __init__(self, prices=None, infos=None):
+        self.prices = prices or {}
+        self.infos = infos or {}
+        self.calls = 0
+        self._faults = []
+        self._lock = threading.Lock()
+
+    def fail_next(self, count, error):
+        """De næste count kald rejser error"""
+        with self._lock:
+            self._faults.extend([error] * count)
+
+    def _call(self):
+        with self._lock:
+            self.calls += 1
+            fault = self._faults.pop(0) if self._faults else None
+        if fault is not None:
+            raise fault
+
+    def download(self, tickers, **kwargs):
+        self._call()
+        tickers = list(tickers)
+        dates = pd.bdate_range(end=pd.Timestamp.now().normalize(), periods=5)
+        frames = {t: pd.DataFrame({"Close": float(self.prices[t])}, index=dates) for t in tickers if t in self.prices}
+        return join_download(frames, tickers)
+
+    def info(self, ticker):
+        self._call()
+        if ticker not in self.infos:
+            raise LookupError(f"Ukendt symbol: {ticker}")
+        return self.infos[ticker]
+
+    def dividends(self, ticker, start=None):
+        self._call()
+        return pd.Series(dtype=float)
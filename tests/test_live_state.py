@@ -0,0 +1,102 @@
+"""Change stream-lytteren mod en falsk database: skæve dokumenter, fejl i apply og afstemningskravet"""
+
+from live_state import LiveStateCache
+
+class FakeStream:
+    def __init__(self, changes, cache):
+        self.changes = list(changes)
+        self.cache = cache
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def alive(self):
+        return True
+
+    def try_next(self):
+        if not self.changes:
+            self.cache.stop()
+            return None
+        change = self.changes.pop(0)
+        self.resume_token = {"_data": len(self.changes)}
+        return change
+
+class FakeMigrations:
+    def __init__(self, applied):
+        self.applied = applied
+
+    def find_one(self, query, projection=None):
+        return {"_id": query["_id"], "status": "applied"} if self.applied else None
+
+class FakeDb:
+    def __init__(self, changes=(), reconciled=True):
+        self.changes = changes
+        self.migrations = FakeMigrations(reconciled)
+        self.cache = None
+
+    def __getitem__(self, name):
+        assert name == "schema_migrations"
+        return self.migrations
+
+    def watch(self, pipeline, **kwargs):
+        return FakeStream(self.changes, self.cache)
+
+def position_change(doc):
+    return {"ns": {"coll": "portfolio"}, "operationType": "update",
+            "documentKey": {"_id": doc["_id"]}, "fullDocument": doc}
+
+def make_cache(changes=(), reconciled=True):
+    db = FakeDb(changes, reconciled)
+    cache = LiveStateCache(db, retry_delay=0.0)
+    db.cache = cache
+    return cache
+
+def seeded(cache, username="simon"):
+    cache.status["state"] = "live"
+    assert cache.seed(username, {"cash": 100.0, "positions": []}, cache.seed_token())
+    return cache
+
+def test_position_with_text_numbers_is_coerced_like_the_ledger():
+    cache = seeded(make_cache())
+    cache.apply(position_change({"_id": 1, "username": "simon", "ticker": "AAPL",
+                                 "shares": "10", "buy_price": "12.5", "currency": "USD"}))
+
+    position = cache.get("simon")["positions"][0]
+    assert position["shares"] == 10 and position["cost"] == 125.0
+
+def test_failing_change_resets_state_and_keeps_listening():
+    cache = seeded(make_cache([
+        position_change({"_id": 1, "username": "simon", "shares": 5}),  # Mangler ticker
+        position_change({"_id": 2, "username": "simon", "ticker": "NOVO-B.CO", "shares": 3, "buy_price": 800}),
+    ]))
+    cache._run()
+
+    status = cache.get_status()
+    assert status["resets"] == 1 and status["events"] == 2
+    assert status["state"] == "stopped"  # Ikke live efter at tråden er ude af løkken
+    assert cache.get("simon") is None
+
+def test_listener_stays_off_until_the_ledger_is_reconciled():
+    cache = make_cache([position_change({"_id": 1, "username": "simon", "ticker": "AAPL", "shares": 1})],
+                       reconciled=False)
+    cache._run()
+
+    assert cache.get_status()["state"] == "unreconciled"
+    assert cache.get_status()["events"] == 0
+
+def test_seed_is_rejected_only_when_that_user_changed():
+    cache = make_cache()
+    cache.status["state"] = "live"
+    token = cache.seed_token()
+    cache.apply(position_change({"_id": 1, "username": "anna", "ticker": "AAPL", "shares": 1}))
+
+    assert cache.seed("simon", {"cash": 0.0, "positions": []}, token)
+    assert not cache.seed("anna", {"cash": 0.0, "positions": []}, token)
+
+    cache._reset("oplog tabt")
+    assert not cache.seed("simon", {"cash": 0.0, "positions": []}, token)
@@ -0,0 +1,96 @@
+"""Vagten omkring upstream mod den falske provider: retry/backoff, circuit breaker og token bucket"""
+
+import pytest
+
+from fake_provider import FakeProvider
+from resilience import CircuitBreaker, CircuitOpenError, ThrottledError, TokenBucket, Upstream
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def make_upstream(clock, rate=100.0, capacity=100, threshold=3, reset=60.0, max_retries=2):
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        clock.sleep(seconds)
+
+    upstream = Upstream("fake", TokenBucket(rate, capacity, clock=clock, sleep=clock.sleep),
+                        CircuitBreaker(threshold, reset, clock=clock), max_retries=max_retries,
+                        acquire_timeout=0.0, sleep=sleep, jitter=lambda: 1.0)
+    return upstream, sleeps
+
+def test_throttling_is_retried_with_exponential_backoff():
+    clock = FakeClock()
+    provider = FakeProvider(infos={"AAPL": {"currency": "USD"}})
+    provider.fail_next(2, ThrottledError("429 Too Many Requests"))
+    upstream, sleeps = make_upstream(clock)
+
+    assert upstream.call(provider.info, "AAPL") == {"currency": "USD"}
+    assert provider.calls == 3
+    assert sleeps == [0.5, 1.0]
+    metrics = upstream.get_metrics()
+    assert metrics["throttles"] == 2 and metrics["retries"] == 2
+    assert metrics["breaker_state"] == CircuitBreaker.CLOSED
+
+def test_unknown_symbol_is_not_retried_and_does_not_trip_the_breaker():
+    clock = FakeClock()
+    provider = FakeProvider()
+    upstream, sleeps = make_upstream(clock, threshold=1)
+
+    with pytest.raises(LookupError):
+        upstream.call(provider.info, "NOPE")
+    assert provider.calls == 1 and sleeps == []
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+def test_breaker_opens_short_circuits_and_recovers_after_probe():
+    clock = FakeClock()
+    provider = FakeProvider(prices={"AAPL": 190.0})
+    provider.fail_next(3, ConnectionError("connection reset"))
+    upstream, _ = make_upstream(clock, threshold=3, reset=60.0)
+
+    with pytest.raises(ConnectionError):
+        upstream.call(provider.download, ["AAPL"])
+    assert upstream.breaker.state == CircuitBreaker.OPEN
+
+    calls = provider.calls
+    with pytest.raises(CircuitOpenError):
+        upstream.call(provider.download, ["AAPL"])
+    assert provider.calls == calls
+
+    clock.now += 60.0
+    assert upstream.breaker.state == CircuitBreaker.HALF_OPEN
+    data = upstream.call(provider.download, ["AAPL"])
+    assert float(data["Close"].iloc[-1]) == 190.0
+    assert upstream.breaker.state == CircuitBreaker.CLOSED
+
+def test_open_breaker_does_not_spend_tokens():
+    clock = FakeClock()
+    provider = FakeProvider(prices={"AAPL": 190.0})
+    upstream, _ = make_upstream(clock, rate=0.001, capacity=1, threshold=1, max_retries=0)
+    upstream.breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        upstream.call(provider.download, ["AAPL"])
+    assert upstream.get_metrics()["rate_limited"] == 0
+    assert upstream.bucket.try_acquire()
+
+def test_rate_limited_probe_is_released():
+    clock = FakeClock()
+    provider = FakeProvider(prices={"AAPL": 190.0})
+    upstream, _ = make_upstream(clock, rate=0.001, capacity=1, threshold=1, reset=10.0, max_retries=0)
+    upstream.breaker.record_failure()
+    clock.now += 10.0
+    assert upstream.bucket.try_acquire()  # Bucket tom når prøvekaldet kommer
+
+    with pytest.raises(ThrottledError):
+        upstream.call(provider.download, ["AAPL"])
+    # Prøven blev ikke brugt - næste kald må stadig prøve når der er et token
+    assert upstream.breaker.allow()
@@ -0,0 +1,57 @@
+"""Vektoriseret værdiansættelse af beholdninger - ét typet DataFrame i stedet for løkker pr. aktie"""
+
+import numpy as np
+import pandas as pd
+
+HOLDING_COLUMNS = ["ticker", "shares", "buy_price", "currency"]
+
+def build_holdings_frame(stocks):
+    """
+    Byg et typet DataFrame fra portfolio-dokumenter.
+    shares/buy_price kan ligge som både str og tal i databasen
+    """
+    frame = pd.DataFrame(list(stocks), columns=HOLDING_COLUMNS)
+    frame["ticker"] = frame["ticker"].astype(str)
+    # Samme semantik som int(float(...)): tomme/ugyldige værdier bliver 0, decimaler skæres af
+    frame["shares"] = pd.to_numeric(frame["shares"], errors="coerce").fillna(0).astype("int64")
+    frame["buy_price"] = pd.to_numeric(frame["buy_price"], errors="coerce").fillna(0.0).astype("float64")
+    frame["currency"] = frame["currency"].fillna("DKK").astype(str)
+    return frame
+
+def value_holdings(holdings, quotes, fx_rates):
+    """
+    Beregn kurs, værdi, kostpris og gevinst/tab i DKK som kolonneoperationer.
+    quotes: {ticker: {'price', 'name', ...}}, fx_rates: Series valuta -> kurs til DKK.
+    Aktier uden aktuel kurs værdiansættes til købskurs
+    """
+    frame = holdings.copy()
+    prices = pd.Series({t: q['price'] for t, q in quotes.items()}, dtype="float64")
+    names = pd.Series({t: q.get('name') for t, q in quotes.items()}, dtype=object)
+
+    frame["has_quote"] = frame["ticker"].isin(prices.index)
+    frame["name"] = frame["ticker"].map(names).fillna(frame["ticker"])
+    frame["current_price"] = frame["ticker"].map(prices).fillna(frame["buy_price"])
+    frame["fx_rate"] = frame["currency"].map(fx_rates).fillna(1.0).astype("float64")
+
+    frame["current_price_dkk"] = frame["current_price"] * frame["fx_rate"]
+    frame["buy_price_dkk"] = frame["buy_price"] * frame["fx_rate"]
+    frame["value"] = frame["current_price_dkk"] * frame["shares"]
+    frame["cost"] = frame["buy_price_dkk"] * frame["shares"]
+    frame["profit_loss"] = frame["value"] - frame["cost"]
+    cost = frame["cost"].to_numpy()
+    frame["profit_loss_pct"] = np.divide(
+        frame["profit_loss"].to_numpy() * 100, cost, out=np.zeros(len(frame)), where=cost > 0
+    )
+    return frame
+
+def summarize_valuation(valued):
+    """Totaler for en værdiansat portefølje"""
+    cost = float(valued["cost"].sum())
+    value = float(valued["value"].sum())
+    profit_loss = value - cost
+    return {
+        "cost": cost,
+        "value": value,
+        "profit_loss": profit_loss,
+        "profit_loss_pct": (profit_loss / cost) * 100 if cost > 0 else 0.0
+    }